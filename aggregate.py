@@ -0,0 +1,137 @@
+import operator
+from itertools import compress, repeat
+
+import county_table
+import result_cache
+from county_table import CountyTable
+
+
+# Returns a sub-population as a percentage of a total population.
+# input: sub-population, total population
+# output: percentage rounded to two places
+def percentage(population: float, total: int) -> float:
+    return round((population/total)*100, 2)
+
+
+# Computes population: and percent: measures over one selection of a
+# CountyTable. The selected 2014 Population values and their total are
+# gathered once and shared by every measure, and each measure's sub-population
+# is computed at most once, so the lines of an aggregate stage, which share
+# one Aggregator, cost one reduction per measure instead of two or more full
+# scans.
+#
+# When the selection's filter signature is known, totals and sub-populations
+# are also kept in result_cache.results, so a later script selecting the same
+# counties gets them back without touching the columns.
+class Aggregator:
+    # Initialize a new Aggregator.
+    # input: the table holding the counties
+    # input: the counties of interest, as rows returned by county_table.locate
+    # input: the total 2014 Population of those counties, when already known
+    # input: result cache key of the selection, or None to skip the shared cache
+    def __init__(self, table: CountyTable, rows, total: int | None = None, key: tuple | None = None):
+        self.table = table
+        self.rows = rows
+        self.key = key
+        self.version = table.version
+        self._populations = None
+        self._total = total
+        self._sub_populations = {}
+
+    # Returns an Aggregator over a collection of counties. A selection that
+    # is exactly one state starts from that state's precomputed total. A
+    # selection made before the table was last updated uses neither that
+    # total nor the shared cache.
+    # input: a CountyTable, a Selection, or views over a CountyTable
+    # output: Aggregator, or None for counties not backed by a CountyTable
+    @classmethod
+    def over(cls, counties) -> 'Aggregator | None':
+        located = county_table.locate(counties)
+        if located is None:
+            return None
+        table, rows = located
+        total = None
+        key = None
+        if isinstance(counties, county_table.CountyTable):
+            key = (table.token, frozenset())
+        elif isinstance(counties, county_table.Selection) and counties.version == table.version:
+            if counties.state is not None:
+                total = table.state_total(counties.state)
+            if counties.signature is not None:
+                key = (table.token, counties.signature)
+        return cls(table, rows, total, key)
+
+    # Returns whether the table has been updated since this Aggregator was made.
+    def stale(self) -> bool:
+        return self.version != self.table.version
+
+    # Forgets every value worked out before the table was last updated. The
+    # update changed values in place, so they would mix old and new data; the
+    # cache key is dropped for good, since the cached results now describe
+    # the selection's updated membership rather than these rows.
+    def _refresh(self) -> None:
+        if self.stale():
+            self.version = self.table.version
+            self.key = None
+            self._populations = None
+            self._total = None
+            self._sub_populations = {}
+
+    # Returns the 2014 Population of every selected county, in row order.
+    def populations(self):
+        self._refresh()
+        if self._populations is None:
+            column = self.table.column(county_table.POPULATION)
+            taken = county_table.take(column, self.rows)
+            self._populations = taken if taken is column else list(taken)
+        return self._populations
+
+    # Returns the total 2014 Population of the selected counties.
+    def total(self) -> int:
+        self._refresh()
+        if self._total is None:
+            self._total = self._cached("total", lambda: sum(self.populations()))
+        return self._total
+
+    # Returns the total 2014 sub-population described by a percentage measure.
+    # input: qualified measure name (e.g. "Education.High School or Higher")
+    # output: sum of percent/100 * population, skipping counties lacking the measure
+    def population(self, measure: str) -> float:
+        self._refresh()
+        value = self._sub_populations.get(measure)
+        if value is None:
+            value = self._sub_populations[measure] = self._cached(measure, lambda: self._reduce(measure))
+        return value
+
+    # Returns the share of the selected population described by a measure.
+    # input: qualified measure name
+    # output: percentage rounded to two places
+    def percent(self, measure: str) -> float:
+        return percentage(self.population(measure), self.total())
+
+    def _cached(self, name: str, compute):
+        if self.key is None:
+            return compute()
+        return result_cache.results.get_or_compute(self.key + (name,), compute)
+
+    # Returns percent/100 * population for every selected county that has
+    # a measure, in row order. The measure's sub-population is their sum.
+    # The products are computed by chained maps over operator functions, so
+    # no Python-level code runs per county.
+    # input: qualified measure name
+    # output: iterable of floats
+    def weighted(self, measure: str):
+        column = self.table.column(measure)
+        if column is None:
+            return ()
+        percents = county_table.take(column, self.rows)
+        if not self.table.has_missing(measure):
+            return map(operator.mul, map(operator.truediv, percents, repeat(100)), self.populations())
+        # A missing value is NaN, the only value not equal to itself.
+        percents = list(percents)
+        return compress(map(operator.mul, map(operator.truediv, percents, repeat(100)), self.populations()),
+                        map(operator.eq, percents, percents))
+
+    def _reduce(self, measure: str) -> float:
+        return sum(self.weighted(measure))
+
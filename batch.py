@@ -0,0 +1,115 @@
+import argparse
+import contextlib
+import glob
+import io
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import build_data
+import hw4
+
+
+# Runs one .ops file the way `python hw4.py` does, capturing what it prints.
+# input: str path of the .ops file
+# output: the script's complete output
+def run_script(path: str) -> str:
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        try:
+            hw4.run_file(path)
+        except:
+            print("ERROR: File not found.")
+    return buffer.getvalue()
+
+
+# Expands the given files and glob patterns into a list of .ops paths.
+# Each pattern's matches are sorted, and arguments keep their given order, so
+# the result (and so the output order) is deterministic.
+# input: list of paths or glob patterns
+# output: list of paths
+def expand(patterns: list[str]) -> list[str]:
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+
+# Runs many .ops files in one process tree. The data set is loaded once here,
+# before the pool starts, so forked workers share it copy-on-write (and the
+# snapshot's pages through the page cache) instead of loading it again.
+# input: list of .ops paths, number of worker processes (default: one per core)
+# output: list of (path, output) pairs in the order the paths were given
+def run_batch(paths: list[str], workers: int | None = None) -> list[tuple[str, str]]:
+    build_data.get_data()
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return [(path, run_script(path)) for path in paths]
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(zip(paths, executor.map(run_script, paths)))
+
+
+# Returns the name of each script's output file: its path relative to the
+# directory holding all of the scripts, with .out in place of .ops, so
+# scripts of the same name in different directories keep apart
+# (inputs/*.ops gives ca.out, ...; a/x.ops and b/x.ops give a/x.out and b/x.out).
+# input: list of .ops paths
+# output: list of relative output paths, in the same order
+# raises ValueError when two scripts would share an output file (e.g. the
+# same script given twice)
+def output_names(paths: list[str]) -> list[str]:
+    if not paths:
+        return []
+    absolute = [os.path.abspath(path) for path in paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in absolute])
+    names = [os.path.splitext(os.path.relpath(path, root))[0] + ".out" for path in absolute]
+    seen = {}
+    for path, name in zip(paths, names):
+        if os.path.normcase(name) in seen:
+            raise ValueError("{} and {} would both be written to {}".format(seen[os.path.normcase(name)], path, name))
+        seen[os.path.normcase(name)] = path
+    return names
+
+
+# Writes each script's output to its own stream: a file in the output
+# directory named by output_names, or one after another on stdout.
+# input: list of (path, output) pairs, output directory or None
+# output: None
+def write_outputs(results: list[tuple[str, str]], output_dir: str | None) -> None:
+    if output_dir is None:
+        for _, output in results:
+            sys.stdout.write(output)
+        return
+    names = output_names([path for path, _ in results])
+    for name, (_, output) in zip(names, results):
+        target = os.path.join(output_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w") as outfile:
+            outfile.write(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many .ops files against the county data set.")
+    parser.add_argument("scripts", nargs="*", default=["inputs/*.ops"],
+                        help=".ops files or glob patterns (default: inputs/*.ops)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="write each script's output to DIR/<name>.out instead of stdout, keeping the "
+                             "scripts' directories below the one they share")
+    args = parser.parse_args()
+    paths = expand(args.scripts)
+    if args.output_dir is not None:
+        try:
+            output_names(paths)
+        except ValueError as error:
+            parser.error(str(error))
+    write_outputs(run_batch(paths, args.jobs), args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import contextlib
+import gc
+import glob
+import io
+import json
+import os
+import pickle
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import build_data
+import county_demographics
+import hw4
+import render
+import result_cache
+import snapshot
+from county_table import GROUPS
+
+
+# The filter and aggregate functions of hw4 that are timed, with the
+# arguments they are called with after the counties.
+FILTERS = [
+    ("filter_by_state", ("CA",)),
+    ("education_greater_than", ("Bachelor's Degree or Higher", 30)),
+    ("education_less_than", ("High School or Higher", 80)),
+    ("ethnicity_greater_than", ("Asian Alone", 5)),
+    ("ethnicity_less_than", ("White Alone", 50)),
+    ("below_poverty_level_greater_than", (20,)),
+    ("below_poverty_level_less_than", (10,)),
+]
+AGGREGATES = [
+    ("population_list", ()),
+    ("population_by_education", ("Bachelor's Degree or Higher",)),
+    ("population_by_ethnicity", ("Hispanic or Latino",)),
+    ("population_below_poverty_level", ()),
+    ("percent_by_education", ("High School or Higher",)),
+    ("percent_by_ethnicity", ("Black Alone",)),
+    ("percent_below_poverty_level", ()),
+]
+
+DATA_NAME = "county_demographics.data"
+
+
+# Times a function. Every repetition starts from a fresh state: setup runs
+# untimed before each call, and the garbage collector is paused while the
+# call runs, as timeit does.
+# input: function to time, number of repetitions, optional setup function
+# output: (list of times in seconds, the function's last result)
+def measure(function, repeat: int, setup=None) -> tuple[list[float], object]:
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        finally:
+            if enabled:
+                gc.enable()
+    return times, result
+
+
+# Returns one benchmark's entry for the results file.
+def _entry(scale: int, name: str, rows: int, times: list[float]) -> dict:
+    return {
+        "scale": scale,
+        "name": name,
+        "rows": rows,
+        "times": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+    }
+
+
+# Forgets every result computed from the data set, so the next operation
+# does its full work.
+def reset_caches() -> None:
+    result_cache.results.clear()
+
+
+# Points the loader at another dataset file and forgets the loaded data set,
+# restoring the original file afterwards.
+# input: path of a county_demographics.data pickle
+@contextlib.contextmanager
+def use_dataset(path: str):
+    constants = county_demographics._Constants
+    original = constants._DATABASE_NAME
+    constants._DATABASE_NAME = path
+    constants._DATASET = None
+    build_data._converted = None
+    reset_caches()
+    try:
+        yield
+    finally:
+        constants._DATABASE_NAME = original
+        constants._DATASET = None
+        build_data._converted = None
+        reset_caches()
+
+
+# Writes a dataset with every county repeated. Copy k > 1 of a county is
+# named "<county> #k", so every (state, county) stays distinct. Only the
+# fields get_data reads are kept, which keeps 100x datasets within memory.
+# input: the original report, repetition factor, path to write
+# output: None
+def write_scaled(report: list[dict], factor: int, path: str) -> None:
+    fields = ['County', 'State', *GROUPS]
+    scaled = []
+    for copy in range(1, factor + 1):
+        for record in report:
+            record = {field: dict(record[field]) if isinstance(record[field], dict) else record[field]
+                      for field in fields if field in record}
+            if copy > 1:
+                record['County'] = "{} #{}".format(record['County'], copy)
+            scaled.append(record)
+    with open(path, "wb") as outfile:
+        pickle.dump(scaled, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Times loading through build_data.get_data: cold (pickle read, converted
+# and the snapshot written), from the snapshot, and warm (already loaded).
+def bench_load(scale: int, path: str, repeat: int) -> list[dict]:
+    def cold_setup():
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(snapshot.snapshot_path(path))
+        county_demographics._Constants._DATASET = None
+        build_data._converted = None
+
+    def snapshot_setup():
+        build_data._converted = None
+
+    results = []
+    for name, setup in (("load.cold", cold_setup), ("load.snapshot", snapshot_setup), ("load.warm", None)):
+        times, table = measure(build_data.get_data, repeat, setup)
+        results.append(_entry(scale, name, len(table), times))
+    return results
+
+
+# Times every filter, every aggregate and display over the whole data set.
+# Sorted indexes are built by an untimed first call; the result cache is
+# cleared before every call.
+def bench_operations(scale: int, repeat: int) -> list[dict]:
+    table = build_data.get_data()
+    results = []
+    for name, arguments in FILTERS:
+        function = getattr(hw4, name)
+        function(table, *arguments)
+        times, selected = measure(lambda: function(table, *arguments), repeat, reset_caches)
+        results.append(_entry(scale, "filter." + name, len(selected), times))
+    for name, arguments in AGGREGATES:
+        function = getattr(hw4, name)
+        times, _ = measure(lambda: function(table, *arguments), repeat, reset_caches)
+        results.append(_entry(scale, "aggregate." + name, len(table), times))
+    for format in render.FORMATS:
+        times, _ = measure(lambda: render.display(table, format, io.StringIO()), repeat)
+        results.append(_entry(scale, "display." + format, len(table), times))
+    return results
+
+
+# Times running every .ops file end to end, output discarded.
+def bench_inputs(scale: int, paths: list[str], repeat: int) -> list[dict]:
+    rows = len(build_data.get_data())
+    results = []
+    for path in paths:
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                hw4.run_file(path)
+        times, _ = measure(run, repeat, reset_caches)
+        results.append(_entry(scale, "inputs." + os.path.basename(path), rows, times))
+    return results
+
+
+# Runs the whole suite at every scale.
+# input: scale factors, number of repetitions, .ops files to run end to end
+# output: results dictionary, as written to the JSON file
+def run(scales: list[int], repeat: int, paths: list[str]) -> dict:
+    results = []
+    source = county_demographics.get_database_path()
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            path = os.path.join(directory, "x{}".format(scale), DATA_NAME)
+            os.makedirs(os.path.dirname(path))
+            if scale == 1:
+                shutil.copyfile(source, path)
+            else:
+                with use_dataset(source):
+                    report = county_demographics.get_report()
+                    write_scaled(report, scale, path)
+                    del report
+            with use_dataset(path):
+                results += bench_load(scale, path, repeat)
+                results += bench_operations(scale, repeat)
+                results += bench_inputs(scale, paths, repeat)
+            os.remove(path)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+# Prints a table of the results, with the change in median time against an
+# earlier results file when one is given.
+# input: results dictionary, earlier results dictionary or None
+# output: None
+def report(results: dict, baseline: dict | None = None) -> None:
+    before = {}
+    if baseline is not None:
+        before = {(entry["scale"], entry["name"]): entry["median"] for entry in baseline["results"]}
+    print("{:>5}  {:<45} {:>9} {:>12} {:>12}{}".format(
+        "scale", "benchmark", "rows", "min ms", "median ms", "  change" if before else ""))
+    for entry in results["results"]:
+        change = ""
+        old = before.get((entry["scale"], entry["name"]))
+        if old:
+            change = "  {:+.1%}".format(entry["median"]/old - 1)
+        print("{:>4}x  {:<45} {:>9} {:>12.3f} {:>12.3f}{}".format(
+            entry["scale"], entry["name"], entry["rows"], entry["min"]*1000, entry["median"]*1000, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading, filters, aggregates, display and .ops scripts.")
+    parser.add_argument("-s", "--scale", type=int, nargs="+", default=[1, 10, 100],
+                        help="dataset sizes as multiples of the county file (default: 1 10 100)")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="repetitions of each benchmark (default: 5)")
+    parser.add_argument("-i", "--inputs", nargs="*", default=["inputs/*.ops"],
+                        help=".ops files or glob patterns to run end to end (default: inputs/*.ops)")
+    parser.add_argument("-o", "--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("-c", "--compare", default=None, metavar="JSON",
+                        help="show the change against the results of an earlier run")
+    args = parser.parse_args()
+    paths = [path for pattern in args.inputs for path in sorted(glob.glob(pattern))]
+    results = run(args.scale, args.repeat, paths)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)
+    report(results, baseline)
+    if args.output is not None:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=1)
+
+
+if __name__ == '__main__':
+    main()
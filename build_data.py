@@ -1,18 +1,26 @@
-import county_demographics
+import snapshot
 
+from county_table import CountyTable, GROUPS
 from data import CountyDemographics
 
 
+# Renames the misspelled 'Median Houseold Income' key found in some records.
+# input: county demographics information as a dictionary
+# output: None (the dictionary is updated in place)
+def fix_income_key(county) -> None:
+    if 'Median Houseold Income' in county['Income']:
+        county['Income']['Median Household Income'] =\
+                county['Income']['Median Houseold Income']
+        del county['Income']['Median Houseold Income']
+
+
 # Given county demographics in dictionary form, convert to an object.
 # input: county demographics information as an inconsistently typed dictionary
 # output: the county demographics information as a CountyDemographics object
 #
 # Note that this function assumes the dictionary is properly structured.
 def convert_county(county) -> CountyDemographics:
-    if 'Median Houseold Income' in county['Income']:
-        county['Income']['Median Household Income'] =\
-                county['Income']['Median Houseold Income']
-        del county['Income']['Median Houseold Income']
+    fix_income_key(county)
     return CountyDemographics(
             county['Age'],
             county['County'],
@@ -24,17 +32,54 @@ def convert_county(county) -> CountyDemographics:
         )
 
 
+# Given the full report in dictionary form, convert it to a columnar table
+# with its state index and per-state population totals built.
+# input: list of county demographics dictionaries
+# output: CountyTable holding one row per county
+def convert_report(report) -> CountyTable:
+    for county in report:
+        fix_income_key(county)
+    table = CountyTable.from_records(report)
+    table.index_states()
+    return table
+
+
 # To avoid reprocessing the full data set on multiple calls of get_data.
 _converted = None
 
 
-# This function retrieves the full demographics data set and converts
-# it to store each entry as a CountyDemographics object.
+# This function retrieves the full demographics data set and converts it to
+# a columnar CountyTable. The table is a sequence of lightweight
+# CountyDemographics views, so it can be used wherever the list of
+# CountyDemographics objects was used before.
+#
+# The converted table is memory-mapped from a snapshot kept next to the
+# dataset, which is rebuilt whenever the dataset file changes. When it has to
+# be rebuilt, only the record groups kept in the table are read from the
+# report. county_demographics is imported here rather than at the top so that
+# importing this module never touches the dataset.
 # input: no input
-# output: county information as a list of CountyDemographics objects
-def get_data() -> list[CountyDemographics]:
+# output: county information as a CountyTable
+def get_data() -> CountyTable:
     global _converted
-    if not _converted:
-       report = county_demographics.get_report()
-       _converted = [convert_county(county) for county in report]
+    if _converted is None:
+       import county_demographics
+       fields = ['County', 'State', *GROUPS]
+       _converted = snapshot.load(county_demographics.get_database_path(),
+                                  lambda: convert_report(county_demographics.get_report(fields)))
     return _converted
+
+
+# Applies a delta to the loaded data set without reloading or re-indexing it:
+# records to insert or replace and counties to delete, keyed by (state,
+# county). The loaded table and everything cached from it are updated in
+# place (see CountyTable.apply_delta). The dataset file and its snapshot are
+# left as they are, so a restarted process starts from the file again.
+# input: list of county dictionaries in the report's form
+# input: list of (state, county) pairs
+# output: (inserted, updated, deleted) counts
+def apply_delta(upserts=(), deletes=()) -> tuple[int, int, int]:
+    upserts = list(upserts)
+    for county in upserts:
+        fix_income_key(county)
+    return get_data().apply_delta(upserts, deletes)
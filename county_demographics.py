@@ -11,7 +11,7 @@ Then just place the files you downloaded alongside it.
 import os as _os
 import pickle as _pickle
 
-__all__ = ['get_report']
+__all__ = ['get_report', 'get_database_path']
 
 def _tifa_definitions():
     return {"type": "ModuleType",
@@ -125,14 +125,32 @@ elif not _os.access(_Constants._DATABASE_NAME, _os.R_OK):
 
 _Constants._DATASET = None
 
-def get_report():
+def get_report(fields=None):
     """
     Retrieves all of the report.
+
+    If fields is given, each record is reduced to just those keys (e.g.
+    'County', 'State', 'Age'), and the full report is not kept in memory
+    unless it was already loaded.
     """
-    if _Constants._DATASET is None:
+    if fields is None:
+        if _Constants._DATASET is None:
+            with open(_Constants._DATABASE_NAME, 'rb') as _:
+                _Constants._DATASET = _pickle.load(_)
+        return _Constants._DATASET
+    dataset = _Constants._DATASET
+    if dataset is None:
         with open(_Constants._DATABASE_NAME, 'rb') as _:
-            _Constants._DATASET = _pickle.load(_)
-    return _Constants._DATASET
+            dataset = _pickle.load(_)
+    return [{field: record[field] for field in fields if field in record}
+            for record in dataset]
+
+
+def get_database_path():
+    """
+    Returns the path of the file the report is loaded from.
+    """
+    return _Constants._DATABASE_NAME
 
 
 if __name__ == '__main__':
@@ -0,0 +1,935 @@
+import array
+import bisect
+import operator
+import sys
+from collections.abc import Mapping, Sequence
+from itertools import compress, count
+
+import result_cache
+
+
+# The record groups kept from the raw report, in display order, mapped to the
+# CountyDemographics attribute each group is exposed under.
+GROUPS = {
+    'Age': 'age',
+    'Education': 'education',
+    'Ethnicities': 'ethnicities',
+    'Income': 'income',
+    'Population': 'population',
+}
+
+# The measure every sub-population and percentage is weighted by.
+POPULATION = 'Population.2014 Population'
+
+_MISSING = float('nan')
+
+# Gives every table a distinct token, so cached results of one table are
+# never mistaken for another's.
+_tokens = count()
+
+
+# Returns the qualified column name for a key within a record group.
+# input: group name (e.g. 'Education'), key within the group
+# output: column name such as "Education.Bachelor's Degree or Higher"
+def measure_name(group: str, key: str) -> str:
+    return group + '.' + key
+
+
+# Returns the typecode of a column, which may be an array or, for a table
+# loaded from a snapshot, a memoryview cast over a memory-mapped file.
+# input: column array or memoryview
+# output: typecode such as 'q' or 'd'
+def typecode(column: array.array | memoryview) -> str:
+    if isinstance(column, memoryview):
+        return column.format
+    return column.typecode
+
+
+# Packs the values of one measure into a contiguous array. Columns holding only
+# integers for every row are kept as int64 so that totals and display output
+# stay integral; everything else is float64 with NaN marking a missing value.
+# input: list of values for every row, None where the row lacks the key
+# output: array of typecode 'q' or 'd'
+def _pack(values: list) -> array.array:
+    if all(type(value) is int for value in values):
+        return array.array('q', values)
+    return array.array('d', [_MISSING if value is None else value for value in values])
+
+
+class CountyTable:
+    # Initialize a new CountyTable. Most callers should use from_records.
+    # input: group name -> list of keys in that group, in display order
+    # input: qualified measure name -> array holding that measure for every row
+    # input: per-row index into strings of the state abbreviation
+    # input: per-row index into strings of the county name
+    # input: interned string table shared by the state and county columns
+    # input: distinct key orders seen within a group (records do not all agree)
+    # input: group name -> per-row index into layouts giving that row's key order
+    def __init__(self,
+                 groups: dict[str, list[str]],
+                 columns: dict[str, array.array],
+                 states: array.array,
+                 counties: array.array,
+                 strings: list[str],
+                 layouts: list[tuple[str, ...]],
+                 layout_ids: dict[str, array.array]):
+        self.groups = groups
+        self.columns = columns
+        self.states = states
+        self.counties = counties
+        self.strings = strings
+        self.layouts = layouts
+        self.layout_ids = layout_ids
+        self.token = next(_tokens)
+        self.version = 0
+        self.live = None
+        self._missing = {}
+        self._sorted = {}
+        self._state_rows = None
+        self._state_totals = None
+        self._row_ids = None
+        self._string_ids = None
+        self._layout_index = None
+
+    # Build a table from county records in the raw report's dictionary form.
+    # input: iterable of county dictionaries (State, County and the GROUPS)
+    # output: CountyTable holding every record as one row
+    @classmethod
+    def from_records(cls, records) -> 'CountyTable':
+        groups = {group: [] for group in GROUPS}
+        values = {}
+        strings = []
+        string_ids = {}
+        states = array.array('I')
+        counties = array.array('I')
+        layouts = []
+        layout_index = {}
+        layout_ids = {group: array.array('H') for group in GROUPS}
+
+        def intern(text):
+            index = string_ids.get(text)
+            if index is None:
+                index = string_ids[text] = len(strings)
+                strings.append(sys.intern(text))
+            return index
+
+        def intern_layout(keys):
+            index = layout_index.get(keys)
+            if index is None:
+                index = layout_index[keys] = len(layouts)
+                layouts.append(keys)
+            return index
+
+        for row, record in enumerate(records):
+            states.append(intern(record['State']))
+            counties.append(intern(record['County']))
+            for group in GROUPS:
+                layout_ids[group].append(intern_layout(tuple(record[group])))
+                for key, value in record[group].items():
+                    name = measure_name(group, key)
+                    column = values.get(name)
+                    if column is None:
+                        groups[group].append(key)
+                        column = values[name] = [None] * row
+                    column.append(value)
+            for column in values.values():
+                if len(column) <= row:
+                    column.append(None)
+
+        columns = {name: _pack(column) for name, column in values.items()}
+        return cls(groups, columns, states, counties, strings, layouts, layout_ids)
+
+    # Returns the array backing one measure, or None if no row has it.
+    # input: qualified measure name
+    # output: array of the measure's value for every row
+    def column(self, name: str) -> array.array | None:
+        return self.columns.get(name)
+
+    # Returns whether any row lacks a value for a measure.
+    # input: qualified measure name
+    # output: True if the column holds a NaN placeholder
+    def has_missing(self, name: str) -> bool:
+        missing = self._missing.get(name)
+        if missing is None:
+            column = self.columns[name]
+            missing = self._missing[name] = (typecode(column) == 'd'
+                                             and any(value != value for value in column))
+        return missing
+
+    # Builds the state -> row ids index along with each state's total 2014
+    # Population, so that state filters and state totals are lookups.
+    # input: no input
+    # output: None
+    def index_states(self) -> None:
+        state_rows = {}
+        for row in self.live_rows():
+            state_rows.setdefault(self.state_of(row), []).append(row)
+        population = self.columns.get(POPULATION)
+        self._state_rows = {state: array.array('I', rows) for state, rows in state_rows.items()}
+        self._state_totals = {} if population is None else {
+            state: sum(map(population.__getitem__, rows)) for state, rows in state_rows.items()}
+
+    # Returns the state index, building it if needed.
+    # input: no input
+    # output: (state -> row ids, state -> total 2014 Population)
+    def state_index(self) -> tuple[dict, dict[str, int]]:
+        if self._state_rows is None:
+            self.index_states()
+        return self._state_rows, self._state_totals
+
+    # Installs a state index that was built earlier, e.g. read from a snapshot.
+    # input: state -> row ids in row order, state -> total 2014 Population
+    # output: None
+    def restore_state_index(self, state_rows: dict, state_totals: dict[str, int]) -> None:
+        self._state_rows = state_rows
+        self._state_totals = state_totals
+
+    # Returns the rows of the counties in a state.
+    # input: two-letter state abbreviation
+    # output: array of row ids in row order (empty for an unknown state)
+    def state_rows(self, state: str) -> array.array:
+        if self._state_rows is None:
+            self.index_states()
+        return self._state_rows.get(state, array.array('I'))
+
+    # Returns the total 2014 Population of the counties in a state.
+    # input: two-letter state abbreviation
+    # output: the precomputed total (0 for an unknown state)
+    def state_total(self, state: str) -> int:
+        if self._state_totals is None:
+            self.index_states()
+        return self._state_totals.get(state, 0)
+
+    # Returns the row mask of counties in a state.
+    # input: two-letter state abbreviation
+    # output: one byte per row, 1 where the county is in the state
+    def state_mask(self, state: str) -> bytes:
+        return self.rows_mask(self.state_rows(state))
+
+    # Returns the sorted index of a measure, building it on first use.
+    # input: qualified measure name
+    # output: SortedIndex over the column, or None if no row has the measure
+    def sorted_index(self, name: str) -> 'SortedIndex | None':
+        index = self._sorted.get(name)
+        if index is None:
+            column = self.columns.get(name)
+            if column is None:
+                return None
+            index = self._sorted[name] = SortedIndex(column, self.live_rows())
+        return index
+
+    # Returns the row mask of counties whose measure is above or below a threshold.
+    # input: qualified measure name, "gt" or "lt", threshold value
+    # output: one byte per row, 1 where the comparison holds (never for missing values)
+    def threshold_mask(self, name: str, comparison: str, threshold: float) -> bytes:
+        index = self.sorted_index(name)
+        if index is None:
+            return bytes(self.row_count)
+        if comparison == "gt":
+            rows = index.above(threshold)
+        elif comparison == "lt":
+            rows = index.below(threshold)
+        else:
+            raise ValueError("Error: Invalid input.")
+        return self.rows_mask(rows)
+
+    # Returns the row mask selecting the given rows.
+    # input: iterable of row ids
+    # output: one byte per row, 1 for each given row
+    def rows_mask(self, rows) -> bytes:
+        mask = bytearray(self.row_count)
+        for row in rows:
+            mask[row] = 1
+        return bytes(mask)
+
+    # Returns the state abbreviation of a row.
+    def state_of(self, row: int) -> str:
+        return self.strings[self.states[row]]
+
+    # Returns the county name of a row.
+    def county_of(self, row: int) -> str:
+        return self.strings[self.counties[row]]
+
+    # Returns the keys a row holds within a group, in the row's original order.
+    def keys_of(self, group: str, row: int) -> tuple[str, ...]:
+        return self.layouts[self.layout_ids[group][row]]
+
+    # Applies a batch of corrections to the table in place: records to insert
+    # or replace and counties to delete, both keyed by (state, county).
+    #
+    # Row ids never move. A replaced county keeps its row, a new county is
+    # appended and a deleted county is only marked dead in the live mask, so
+    # the state index, the sorted indexes and the cached results are patched
+    # one changed row at a time rather than rebuilt. Values are overwritten
+    # in place, so selections and aggregators made before the update read the
+    # new values; only their membership is frozen: a deleted county stays in
+    # them and a new one is not added. New selections see the whole update.
+    #
+    # The whole delta is checked before anything is changed, so a bad record
+    # leaves the table, its indexes and the cached results as they were.
+    # input: iterable of county dictionaries (State, County and the GROUPS)
+    # input: iterable of (state, county) pairs; unknown counties are ignored
+    # output: (inserted, updated, deleted) counts
+    # raises KeyError for a record missing State, County or a group, and
+    # TypeError for a field, key or value of the wrong type
+    def apply_delta(self, upserts=(), deletes=()) -> tuple[int, int, int]:
+        upserts = list(upserts)
+        deletes = [tuple(key) for key in deletes]
+        for record in upserts:
+            _check_record(record)
+        for key in deletes:
+            if len(key) != 2:
+                raise TypeError('a deleted county must be given as (state, county), not {!r}'.format(key))
+        self._make_writable()
+        row_ids = self._row_index()
+        before = {}
+        inserted = updated = deleted = 0
+        for key in deletes:
+            row = row_ids.pop(tuple(key), None)
+            if row is None:
+                continue
+            before.setdefault(row, self._row_values(row))
+            self._unindex(row)
+            if self.live is None:
+                self.live = bytearray(b'\x01') * self.row_count
+            self.live[row] = 0
+            deleted += 1
+        for record in upserts:
+            key = (record['State'], record['County'])
+            row = row_ids.get(key)
+            if row is None:
+                row = row_ids[key] = self._append_row()
+                before[row] = None
+                inserted += 1
+            else:
+                before.setdefault(row, self._row_values(row))
+                self._unindex(row)
+                updated += 1
+            self._write_row(row, record)
+            self._index(row)
+        if before:
+            self.version += 1
+            self._patch_results(before)
+        return inserted, updated, deleted
+
+    # Copies any memory-mapped (read-only) arrays into arrays of their own.
+    def _make_writable(self) -> None:
+        def own(column):
+            if not isinstance(column, memoryview):
+                return column
+            copy = array.array(column.format)
+            copy.frombytes(column.cast('B'))
+            return copy
+        self.columns = {name: own(column) for name, column in self.columns.items()}
+        self.states = own(self.states)
+        self.counties = own(self.counties)
+        self.layout_ids = {group: own(ids) for group, ids in self.layout_ids.items()}
+        if self._state_rows is not None:
+            self._state_rows = {state: own(rows) for state, rows in self._state_rows.items()}
+
+    # Returns the (state, county) -> row lookup of the live rows, building it if needed.
+    def _row_index(self) -> dict[tuple[str, str], int]:
+        if self._row_ids is None:
+            self._row_ids = {(self.state_of(row), self.county_of(row)): row for row in self.live_rows()}
+        return self._row_ids
+
+    # Returns a row's state and every measure's value, or None for a dead row.
+    def _row_values(self, row: int) -> tuple[str, dict] | None:
+        if self.live is not None and not self.live[row]:
+            return None
+        return self.state_of(row), {name: column[row] for name, column in self.columns.items()}
+
+    def _intern(self, text: str) -> int:
+        if self._string_ids is None:
+            self._string_ids = {string: index for index, string in enumerate(self.strings)}
+        index = self._string_ids.get(text)
+        if index is None:
+            index = self._string_ids[text] = len(self.strings)
+            self.strings.append(sys.intern(text))
+        return index
+
+    def _intern_layout(self, keys: tuple[str, ...]) -> int:
+        if self._layout_index is None:
+            self._layout_index = {layout: index for index, layout in enumerate(self.layouts)}
+        index = self._layout_index.get(keys)
+        if index is None:
+            index = self._layout_index[keys] = len(self.layouts)
+            self.layouts.append(keys)
+        return index
+
+    # Adds an empty row at the end of every array and returns its id.
+    def _append_row(self) -> int:
+        row = self.row_count
+        self.states.append(0)
+        self.counties.append(0)
+        for ids in self.layout_ids.values():
+            ids.append(0)
+        for column in self.columns.values():
+            column.append(0)
+        if self.live is not None:
+            self.live.append(1)
+        return row
+
+    # Stores a record's values in a row. A measure the record lacks becomes
+    # missing (NaN), which turns an integer column into a float one just as
+    # from_records would have packed it; a key no row had before gets a new
+    # column, missing for every other row.
+    def _write_row(self, row: int, record) -> None:
+        self.states[row] = self._intern(record['State'])
+        self.counties[row] = self._intern(record['County'])
+        for group in GROUPS:
+            items = record[group]
+            self.layout_ids[group][row] = self._intern_layout(tuple(items))
+            for key in items:
+                if measure_name(group, key) not in self.columns:
+                    self.groups[group].append(key)
+                    self.columns[measure_name(group, key)] = array.array('d', [_MISSING]) * self.row_count
+            for key in self.groups[group]:
+                self._set(measure_name(group, key), row, items.get(key))
+
+    def _set(self, name: str, row: int, value) -> None:
+        column = self.columns[name]
+        if typecode(column) == 'q' and type(value) is not int:
+            column = self.columns[name] = array.array('d', column)
+            # The sorted index holds the old integer values; it is rebuilt on next use.
+            self._sorted.pop(name, None)
+            if name == POPULATION and self._state_rows is not None:
+                for state in self._state_rows:
+                    self._update_state_total(state)
+        previous = column[row]
+        if value is None:
+            value = _MISSING
+        if value != value:
+            self._missing[name] = True
+        elif previous != previous:
+            # The row may have been the column's last missing value.
+            self._missing.pop(name, None)
+        column[row] = value
+
+    # Removes a live row from the state index and the sorted indexes.
+    def _unindex(self, row: int) -> None:
+        if self._state_rows is not None:
+            state = self.state_of(row)
+            rows = self._state_rows[state]
+            del rows[bisect.bisect_left(rows, row)]
+            if not rows:
+                del self._state_rows[state]
+                self._state_totals.pop(state, None)
+            else:
+                self._update_state_total(state)
+        for name, index in self._sorted.items():
+            value = self.columns[name][row]
+            if value == value:
+                index.remove(row, value)
+
+    # Adds a live row to the state index and the sorted indexes.
+    def _index(self, row: int) -> None:
+        if self._state_rows is not None:
+            state = self.state_of(row)
+            rows = self._state_rows.get(state)
+            if rows is None:
+                self._state_rows[state] = array.array('I', [row])
+            else:
+                rows.insert(bisect.bisect_left(rows, row), row)
+            self._update_state_total(state)
+        for name, index in self._sorted.items():
+            value = self.columns[name][row]
+            if value == value:
+                index.insert(row, value)
+
+    # Recomputes one state's total from its rows, in row order, so the total
+    # is exactly what index_states would compute.
+    def _update_state_total(self, state: str) -> None:
+        population = self.columns.get(POPULATION)
+        if population is not None:
+            self._state_totals[state] = sum(map(population.__getitem__, self._state_rows[state]))
+
+    # Brings the shared result cache up to date with the changed rows.
+    # Cached selections have their mask bits set or cleared for each changed
+    # row, and cached integer population totals are adjusted by the changed
+    # rows' populations. A cached sub-population is a float sum that could only be
+    # adjusted with rounding error, so it is dropped when a changed row was
+    # or now is among its counties and kept otherwise.
+    # input: row -> its state and values before the update (None if new)
+    def _patch_results(self, before: dict) -> None:
+        after = {row: self._row_values(row) for row in before}
+        cache = result_cache.results
+        for key, value in cache.entries():
+            if key[0] != self.token:
+                continue
+            signature = key[1]
+            changes = [(row, _matches(signature, before[row]), _matches(signature, after[row]))
+                       for row in before]
+            if len(key) == 2:
+                mask = bytearray(value.mask)
+                mask.extend(bytes(self.row_count - len(mask)))
+                for row, _, selected in changes:
+                    mask[row] = selected
+                cache.replace(key, Selection(self, bytes(mask), state=value.state, signature=signature))
+            elif key[2] == 'total':
+                total = value
+                for row, was_selected, selected in changes:
+                    if was_selected:
+                        total -= before[row][1].get(POPULATION, _MISSING)
+                    if selected:
+                        total += after[row][1].get(POPULATION, _MISSING)
+                if type(total) is int and typecode(self.columns[POPULATION]) == 'q':
+                    cache.replace(key, total)
+                else:
+                    cache.discard(key)
+            elif any(was_selected or selected for _, was_selected, selected in changes):
+                cache.discard(key)
+
+    # The number of rows, counting rows deleted by apply_delta. Row ids and
+    # masks range over all of them.
+    @property
+    def row_count(self) -> int:
+        return len(self.states)
+
+    # Returns the ids of the rows that have not been deleted, in row order.
+    def live_rows(self) -> range | list[int]:
+        if self.live is None:
+            return range(self.row_count)
+        return list(compress(range(self.row_count), self.live))
+
+    def __len__(self):
+        if self.live is None:
+            return len(self.states)
+        return self.live.count(1)
+
+    # Indexes the live rows as get_data()'s list of counties was indexed: an
+    # int gives one county, a slice a list of them.
+    def __getitem__(self, index: int | slice) -> 'CountyView | list[CountyView]':
+        rows = self.live_rows()
+        if isinstance(index, slice):
+            return [CountyView(self, row) for row in rows[index]]
+        try:
+            return CountyView(self, rows[operator.index(index)])
+        except IndexError:
+            raise IndexError('county row out of range') from None
+
+    def __iter__(self):
+        for row in self.live_rows():
+            yield CountyView(self, row)
+
+    def __repr__(self):
+        return 'CountyTable({} rows, {} measures)'.format(len(self), len(self.columns))
+
+
+# The rows of one measure ordered by value, so that a threshold filter is a
+# binary search plus a slice instead of a comparison against every row.
+# Missing (NaN) values are left out and so never pass a threshold.
+class SortedIndex:
+    # Initialize a new SortedIndex.
+    # input: column array of a CountyTable
+    # input: the rows to index (default: every row)
+    def __init__(self, column: array.array, rows=None):
+        if rows is None:
+            rows = range(len(column))
+        order = sorted((row for row in rows if column[row] == column[row]),
+                       key=column.__getitem__)
+        self.order = array.array('I', order)
+        self.values = array.array(typecode(column), map(column.__getitem__, order))
+
+    # Returns the rows whose value is greater than the threshold.
+    # input: threshold value
+    # output: array of row ids, in ascending order of value
+    def above(self, threshold: float) -> array.array:
+        return self.order[bisect.bisect_right(self.values, threshold):]
+
+    # Returns the rows whose value is less than the threshold.
+    # input: threshold value
+    # output: array of row ids, in ascending order of value
+    def below(self, threshold: float) -> array.array:
+        return self.order[:bisect.bisect_left(self.values, threshold)]
+
+    # Adds a row's value to the index.
+    def insert(self, row: int, value: float) -> None:
+        position = bisect.bisect_right(self.values, value)
+        self.order.insert(position, row)
+        self.values.insert(position, value)
+
+    # Removes a row's value from the index.
+    def remove(self, row: int, value: float) -> None:
+        position = bisect.bisect_left(self.values, value)
+        while self.order[position] != row:
+            position += 1
+        del self.order[position]
+        del self.values[position]
+
+
+# Checks that a record can be written to a row: State and County strings and
+# every group a mapping of string keys to numbers (None for a missing value).
+# input: county dictionary
+# output: None
+# raises KeyError or TypeError for a record that cannot be written
+def _check_record(record) -> None:
+    for field in ('State', 'County'):
+        if not isinstance(record[field], str):
+            raise TypeError('{} must be a string, not {!r}'.format(field, record[field]))
+    for group in GROUPS:
+        items = record[group]
+        if not isinstance(items, Mapping):
+            raise TypeError('{} must be a mapping, not {!r}'.format(group, items))
+        for key, value in items.items():
+            if not isinstance(key, str):
+                raise TypeError('{} key must be a string, not {!r}'.format(group, key))
+            if value is not None and not isinstance(value, (int, float)):
+                raise TypeError('{}.{} must be a number, not {!r}'.format(group, key, value))
+
+
+# Returns whether a row satisfies every term of a selection's signature.
+# input: signature, the row's state and values as returned by
+#        CountyTable._row_values (None for a dead or not yet existing row)
+# output: 1 if the row is selected, else 0
+def _matches(signature: frozenset, row) -> int:
+    if row is None:
+        return 0
+    state, values = row
+    for term in signature:
+        if term[0] == 'state':
+            if state != term[1]:
+                return 0
+            continue
+        comparison, name, threshold = term
+        value = values.get(name, _MISSING)
+        if not (value > threshold if comparison == 'gt' else
+                value < threshold if comparison == 'lt' else
+                value >= threshold):
+            return 0
+    return 1
+
+
+# A read-only mapping over one record group of a single row, standing in for
+# the dictionaries CountyDemographics holds. Only the keys the original record
+# had are present, in the record's own order.
+class GroupView(Mapping):
+    __slots__ = ('_table', '_group', '_row')
+
+    def __init__(self, table: CountyTable, group: str, row: int):
+        self._table = table
+        self._group = group
+        self._row = row
+
+    def __getitem__(self, key: str) -> float:
+        if key not in self._table.keys_of(self._group, self._row):
+            raise KeyError(key)
+        return self._table.columns[measure_name(self._group, key)][self._row]
+
+    def __contains__(self, key) -> bool:
+        return key in self._table.keys_of(self._group, self._row)
+
+    def __iter__(self):
+        return iter(self._table.keys_of(self._group, self._row))
+
+    def __len__(self):
+        return len(self._table.keys_of(self._group, self._row))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _group_property(group: str) -> property:
+    return property(lambda self: GroupView(self._table, group, self._row))
+
+
+# A lightweight, read-only CountyDemographics backed by one row of a
+# CountyTable. It exposes the same attributes without copying any data.
+class CountyView:
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table: CountyTable, row: int):
+        self._table = table
+        self._row = row
+
+    age = _group_property('Age')
+    education = _group_property('Education')
+    ethnicities = _group_property('Ethnicities')
+    income = _group_property('Income')
+    population = _group_property('Population')
+
+    @property
+    def county(self) -> str:
+        return self._table.county_of(self._row)
+
+    @property
+    def state(self) -> str:
+        return self._table.state_of(self._row)
+
+    @property
+    def row(self) -> int:
+        return self._row
+
+    @property
+    def table(self) -> CountyTable:
+        return self._table
+
+    def __eq__(self, other):
+        return (isinstance(other, CountyView)
+                and self._table is other._table and self._row == other._row)
+
+    def __hash__(self):
+        return hash((id(self._table), self._row))
+
+    def __repr__(self):
+        return 'CountyDemographics({}, {}, {}, {}, {}, {}, {})'.format(
+                self.age,
+                self.county,
+                self.education,
+                self.ethnicities,
+                self.income,
+                self.population,
+                self.state
+            )
+
+
+# Combines two row masks, keeping the rows selected by both.
+# input: two masks of the same length, one 0/1 byte per row
+# output: the intersection as a mask of the same length
+def mask_and(first: bytes, second: bytes) -> bytes:
+    # Each byte is 0 or 1, so a bitwise AND of the masks read as integers is
+    # a row-wise AND, done in a single C-level operation.
+    combined = int.from_bytes(first, 'little') & int.from_bytes(second, 'little')
+    return combined.to_bytes(len(first), 'little')
+
+
+# A subset of a CountyTable's rows, held as a mask with one 0/1 byte per row.
+# Filters narrow a selection by ANDing masks; rows are only turned into
+# CountyView objects when the selection is iterated or indexed. It reads
+# like the list of counties the filters used to return: a read-only
+# sequence of views, equal to a list of the same views.
+class Selection(Sequence):
+    # Initialize a new Selection.
+    # input: the table being selected from
+    # input: one byte per row of the table, 1 where the row is selected
+    #        (may be None when rows is given; it is then built on first use)
+    # input: whether every row of the table is selected
+    # input: the state, when the selection is exactly the counties of one state
+    # input: the filter terms that produced the selection from the whole table,
+    #        or None when they are not known
+    # input: the selected row ids in row order, when already known
+    def __init__(self, table: CountyTable, mask: bytes | None, whole: bool = False, state: str | None = None,
+                 signature: frozenset | None = None, rows: array.array | None = None):
+        self.table = table
+        self._mask = mask
+        self.whole = whole
+        self.state = state
+        self.signature = signature
+        self._rows = rows
+        self._count = None if rows is None else len(rows)
+        self.version = table.version
+
+    # The row mask, one 0/1 byte per row of the table.
+    @property
+    def mask(self) -> bytes:
+        if self._mask is None:
+            self._mask = self.table.rows_mask(self._rows)
+        return self._mask
+
+    # The approximate memory the selection holds once its mask and row ids
+    # are both built: one byte per row of the table and four per selected row.
+    @property
+    def nbytes(self) -> int:
+        return self.table.row_count + 4 * len(self)
+
+    # Returns a selection of every (live) row of a table.
+    @classmethod
+    def all(cls, table: CountyTable) -> 'Selection':
+        mask = b'\x01' * table.row_count if table.live is None else bytes(table.live)
+        return cls(table, mask, whole=True, signature=frozenset())
+
+    # Returns the rows of this selection that are also selected by a mask.
+    # input: mask over the same table
+    # output: new Selection
+    def where(self, mask: bytes) -> 'Selection':
+        if self.whole:
+            return Selection(self.table, mask)
+        return Selection(self.table, mask_and(self.mask, mask))
+
+    # Returns the counties of this selection that are in a state.
+    # input: two-letter state abbreviation
+    # output: new Selection, remembering the state when it covers the whole state
+    def in_state(self, state: str) -> 'Selection':
+        def build():
+            rows = self.table.state_rows(state)
+            if not self.whole:
+                return self.where(self.table.rows_mask(rows))
+            selection = Selection(self.table, self.table.rows_mask(rows), state=state)
+            selection._count = len(rows)
+            return selection
+        return self._filtered(("state", state), build)
+
+    # Returns the counties of this selection whose measure is above or below a threshold.
+    # input: qualified measure name, "gt" or "lt", threshold value
+    # output: new Selection
+    def threshold(self, name: str, comparison: str, threshold: float) -> 'Selection':
+        return self._filtered((comparison, name, float(threshold)),
+                              lambda: self.where(self.table.threshold_mask(name, comparison, threshold)))
+
+    # Applies one filter term, going through the result cache when the
+    # selection's own filter terms are known. Filters commute, so the
+    # signature is the set of terms and any chain of the same filters, in
+    # any order, shares one cached result. A selection made before the table
+    # was last updated is filtered without the cache.
+    def _filtered(self, term: tuple, build) -> 'Selection':
+        if self.signature is None or self.version != self.table.version:
+            return build()
+        signature = self.signature | {term}
+
+        def build_signed():
+            selection = build()
+            selection.signature = signature
+            return selection
+        return result_cache.results.get_or_compute((self.table.token, signature), build_signed)
+
+    # Returns the ids of the selected rows, in row order.
+    def rows(self) -> list[int]:
+        if self._rows is not None:
+            return list(self._rows)
+        return list(compress(range(len(self.mask)), self.mask))
+
+    # Splits the selection by state, visiting each selected row once.
+    # input: no input
+    # output: state -> Selection of its selected counties, states in
+    #         alphabetical order, states with no selected county left out
+    def group_by_state(self) -> dict[str, 'Selection']:
+        state_rows, _ = self.table.state_index()
+        groups = {}
+        for state in sorted(state_rows):
+            rows = state_rows[state]
+            if not self.whole:
+                rows = array.array('I', compress(rows, map(self.mask.__getitem__, rows)))
+            if len(rows) == 0:
+                continue
+            signature = None if self.signature is None else self.signature | {("state", state)}
+            groups[state] = Selection(self.table, None, state=state if self.whole else None,
+                                      signature=signature, rows=rows)
+        return groups
+
+    # Splits the selection into buckets of a measure's value. The thresholds
+    # t1 < t2 < ... give the buckets "< t1", "t1 to < t2", ..., ">= tn".
+    # Each bucket is read off the measure's sorted index with two binary
+    # searches; counties missing the measure fall in no bucket.
+    # input: qualified measure name, ascending thresholds
+    # output: bucket label -> Selection, in ascending order, empty buckets left out
+    def group_by_buckets(self, name: str, thresholds: list[float]) -> dict[str, 'Selection']:
+        index = self.table.sorted_index(name)
+        if index is None:
+            return {}
+        thresholds = sorted(float(threshold) for threshold in thresholds)
+        bounds = [None] + thresholds + [None]
+        groups = {}
+        for low, high in zip(bounds, bounds[1:]):
+            start = 0 if low is None else bisect.bisect_left(index.values, low)
+            stop = len(index.order) if high is None else bisect.bisect_left(index.values, high)
+            rows = sorted(index.order[start:stop])
+            if not self.whole:
+                rows = compress(rows, map(self.mask.__getitem__, rows))
+            rows = array.array('I', rows)
+            if len(rows) == 0:
+                continue
+            if low is None:
+                label, terms = "< {}".format(high), {("lt", name, high)}
+            elif high is None:
+                label, terms = ">= {}".format(low), {("ge", name, low)}
+            else:
+                label, terms = "{} to < {}".format(low, high), {("ge", name, low), ("lt", name, high)}
+            signature = None if self.signature is None else self.signature | terms
+            groups[label] = Selection(self.table, None, signature=signature, rows=rows)
+        return groups
+
+    # Returns the selected row ids as an array, keeping it for later indexing.
+    def _row_ids(self) -> array.array:
+        if self._rows is None:
+            self._rows = array.array('I', compress(range(len(self.mask)), self.mask))
+        return self._rows
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.mask.count(1)
+        return self._count
+
+    def __getitem__(self, index: int | slice) -> CountyView | list[CountyView]:
+        rows = self._row_ids()
+        if isinstance(index, slice):
+            return [CountyView(self.table, row) for row in rows[index]]
+        try:
+            return CountyView(self.table, rows[operator.index(index)])
+        except IndexError:
+            raise IndexError('selection index out of range') from None
+
+    def __eq__(self, other):
+        if isinstance(other, Selection):
+            return self.table is other.table and self._row_ids() == other._row_ids()
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __iter__(self):
+        if self._rows is not None:
+            rows = self._rows
+        else:
+            rows = compress(range(len(self.mask)), self.mask)
+        for row in rows:
+            yield CountyView(self.table, row)
+
+    def __repr__(self):
+        return 'Selection({} of {} rows)'.format(len(self), len(self.table))
+
+
+# Returns a Selection for counties that can be filtered by mask.
+# input: a CountyTable or a Selection
+# output: Selection, or None for any other collection of counties
+def selection_of(counties) -> Selection | None:
+    if isinstance(counties, Selection):
+        return counties
+    if isinstance(counties, CountyTable):
+        return Selection.all(counties)
+    return None
+
+
+# Finds the table and rows behind a collection of counties so that aggregates
+# can read the columns directly.
+# input: a CountyTable, a Selection, or a sequence of CountyView objects
+# output: (table, rows) or None when the counties are not all views of a
+#         single table (e.g. plain CountyDemographics objects) or are a
+#         one-shot iterator, which the caller must still be able to read in
+#         full; rows is a range, a list or array of row ids, or a row mask
+def locate(counties) -> tuple[CountyTable, range | list[int] | array.array | bytes] | None:
+    if isinstance(counties, CountyTable):
+        if counties.live is not None:
+            return counties, bytes(counties.live)
+        return counties, range(counties.row_count)
+    if isinstance(counties, Selection):
+        if counties._rows is not None:
+            return counties.table, counties._rows
+        return counties.table, counties.mask
+    if not isinstance(counties, Sequence):
+        return None
+    table = None
+    rows = []
+    for county in counties:
+        if not isinstance(county, CountyView):
+            return None
+        if table is None:
+            table = county.table
+        elif county.table is not table:
+            return None
+        rows.append(county.row)
+    if table is None:
+        return None
+    return table, rows
+
+
+# Reads one column at the given rows.
+# input: column array, rows as returned by locate (a full range reads the
+#        column as-is, a mask is applied with itertools.compress)
+# output: iterable of the column's values at those rows
+def take(column: array.array, rows: range | list[int] | array.array | bytes):
+    if isinstance(rows, range) and rows == range(len(column)):
+        return column
+    if isinstance(rows, (bytes, bytearray)):
+        return compress(column, rows)
+    return map(column.__getitem__, rows)
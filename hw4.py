@@ -1,19 +1,32 @@
+import bisect
 import build_data
 import sys
 import data
+import county_table
+import aggregate
+import ops_plan
+import ops_trace
+import render
 
-full_data = build_data.get_data()
-operations = ["DEFAULT","population-total", "population:", "percent:", "display", "gt:", "lt:", "state"]
-keys = ["DEFAULT","Bachelor's Degree or Higher", "High School or Higher", "American Indian and Alaska Native Alone",
-        "Asian Alone", "Black Alone", "Hispanic or Latino", "Native Hawaiian and Other Pacific Islander Alone",
-        "Two or More Races", "White Alone", "White Alone, not Hispanic or Latino", "Persons Below Poverty Level"]
-filters = ["state:","lt:","gt:"]
+operations = ops_plan.OPERATIONS
+keys = ops_plan.KEYS
+filters = ops_plan.FILTERS
+
+# The full data set is only loaded the first time an operation needs it, so importing this module or running a
+# script that fails early does not pay for it. Accessing hw4.full_data still works and loads it on demand.
+def __getattr__(name : str):
+    if name == "full_data":
+        return build_data.get_data()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 # PART 1
 # Returns the total 2014 Population from the given countries in the provided list
 # INPUT: list of CountyDemographics objects
 # OUTPUT: integer representing the population sum
 def population_list(counties : list[data.CountyDemographics]) -> int:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.total()
     x = [county.population['2014 Population'] for county in counties]
     return sum(x)
 
@@ -22,6 +35,9 @@ def population_list(counties : list[data.CountyDemographics]) -> int:
 # INPUT: list of County Demographics objects, two-letter state abbreviation str
 # OUTPUT: list of County Demographic objects within the specified state
 def filter_by_state(counties : list[data.CountyDemographics], text : str) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.in_state(text)
     return [county for county in counties if county.state == text]
 
 # PART 3
@@ -29,6 +45,9 @@ def filter_by_state(counties : list[data.CountyDemographics], text : str) -> lis
 # INPUT: list of County Demographic Objects, education key of interest
 # OUTPUT: float repr total sub-population in the specified key of interest based on given counties
 def population_by_education(counties : list[data.CountyDemographics], edu : str) -> float:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.population(county_table.measure_name("Education", edu))
     x = [(county.education[edu]/100)*county.population['2014 Population'] for county in counties if edu in county.education]
     return sum(x)
 
@@ -36,6 +55,9 @@ def population_by_education(counties : list[data.CountyDemographics], edu : str)
 # INPUT: list of County Demographic Objects, ethnicity key of interest
 # OUTPUT: float repr total sub-population in the specified key of interest based on given counties
 def population_by_ethnicity(counties : list[data.CountyDemographics], eth : str) -> float:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.population(county_table.measure_name("Ethnicities", eth))
     x = [(county.ethnicities[eth]/100)*county.population['2014 Population'] for county in counties if eth in county.ethnicities]
     return sum(x)
 
@@ -43,6 +65,9 @@ def population_by_ethnicity(counties : list[data.CountyDemographics], eth : str)
 # INPUT: list of County Demographic Objects
 # OUTPUT: float repr total sub-population in the specified key of interest based on given counties
 def population_below_poverty_level(counties : list[data.CountyDemographics]) -> float:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.population("Income.Persons Below Poverty Level")
     x = [(county.income['Persons Below Poverty Level']/100)*county.population['2014 Population'] for county in counties]
     return sum(x)
 
@@ -51,18 +76,27 @@ def population_below_poverty_level(counties : list[data.CountyDemographics]) ->
 # INPUT: list of County Demographic Objects, education key of interest
 # OUTPUT: float repr total sub-population in the specified key of interest based on given counties
 def percent_by_education(counties : list[data.CountyDemographics], edu : str) -> float:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.percent(county_table.measure_name("Education", edu))
     return round((population_by_education(counties,edu)/population_list(counties))*100,2)
 
 # Returns the percentage of the total population across the set of counties that are in the specified ethnicity key
 # INPUT: list of County Demographic Objects, ethnicity key of interest
 # OUTPUT: float repr total sub-population in the specified key of interest based on given counties
 def percent_by_ethnicity(counties : list[data.CountyDemographics], eth : str) -> float:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.percent(county_table.measure_name("Ethnicities", eth))
     return round((population_by_ethnicity(counties,eth)/population_list(counties)) * 100,2)
 
 # Returns the percentage of the total population across the set of counties that are below poverty level
 # INPUT: list of County Demographic Objects
 # OUTPUT: float repr total sub-population in the specified key of interest based on given counties
 def percent_below_poverty_level(counties : list[data.CountyDemographics]) -> float:
+    aggregator = aggregate.Aggregator.over(counties)
+    if aggregator is not None:
+        return aggregator.percent("Income.Persons Below Poverty Level")
     return round((population_below_poverty_level(counties)/population_list(counties)) * 100,2)
 
 # PART 5
@@ -70,150 +104,250 @@ def percent_below_poverty_level(counties : list[data.CountyDemographics]) -> flo
 # INPUT: list of County Demographic objects, str of the education key of interest, float of the threshold value
 # OUTPUT: list of County Demographic objects representing counties greater than the given threshold
 def education_greater_than(counties : list[data.CountyDemographics], edu : str, threshold : float) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.threshold(county_table.measure_name("Education", edu), "gt", threshold)
     return [county for county in counties if edu in county.education and county.education[edu] > threshold]
 
 # Returns a list of counties whose specified education key value is less than the given threshold
 # INPUT: list of County Demographic objects, str of the education key of interest, float of the threshold value
 # OUTPUT: list of County Demographic objects representing counties greater than the given threshold
 def education_less_than(counties : list[data.CountyDemographics], edu : str, threshold : float) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.threshold(county_table.measure_name("Education", edu), "lt", threshold)
     return [county for county in counties if edu in county.education and county.education[edu] < threshold]
 
 # Returns a list of counties whose specified ethnicity key value is greater than the given threshold
 # INPUT: list of County Demographic objects, str of the ethnicity key of interest, float of the threshold value
 # OUTPUT: list of County Demographic objects representing counties greater than the given threshold
 def ethnicity_greater_than(counties : list[data.CountyDemographics], eth : str, threshold : float) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.threshold(county_table.measure_name("Ethnicities", eth), "gt", threshold)
     return [county for county in counties if eth in county.ethnicities and county.ethnicities[eth] > threshold]
 
 # Returns a list of counties whose specified ethnicity key value is less than the given threshold
 # INPUT: list of County Demographic objects, str of the ethnicity key of interest, float of the threshold value
 # OUTPUT: list of County Demographic objects representing counties greater than the given threshold
 def ethnicity_less_than(counties : list[data.CountyDemographics], eth : str, threshold : float) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.threshold(county_table.measure_name("Ethnicities", eth), "lt", threshold)
     return [county for county in counties if eth in county.ethnicities and county.ethnicities[eth] < threshold]
 
 # Returns a list of counties whose population below poverty level is greater than the given threshold
 # INPUT: list of County Demographic objects, float of the threshold value
 # OUTPUT: list of County Demographic objects representing counties greater than the given threshold
 def below_poverty_level_greater_than(counties : list[data.CountyDemographics], threshold : float) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.threshold("Income.Persons Below Poverty Level", "gt", threshold)
     return [county for county in counties if county.income['Persons Below Poverty Level'] > threshold]
 
 # Returns a list of counties whose population below poverty level is less than the given threshold
 # INPUT: list of County Demographic objects, float of the threshold value
 # OUTPUT: list of County Demographic objects representing counties greater than the given threshold
 def below_poverty_level_less_than(counties : list[data.CountyDemographics], threshold : float) -> list[data.CountyDemographics]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.threshold("Income.Persons Below Poverty Level", "lt", threshold)
     return [county for county in counties if county.income['Persons Below Poverty Level'] < threshold]
 
+# PART 6
+# Returns the given counties grouped by state. Table-backed counties are split in a single pass over the state index.
+# INPUT: list of County Demographic objects
+# OUTPUT: dictionary of two-letter state abbreviation -> counties in that state, in alphabetical order of state
+def group_by_state(counties : list[data.CountyDemographics]) -> dict[str, list[data.CountyDemographics]]:
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.group_by_state()
+    groups = {}
+    for county in counties:
+        groups.setdefault(county.state, []).append(county)
+    return {state: groups[state] for state in sorted(groups)}
+
+# Returns the given counties grouped into buckets of one measure. The thresholds t1 < ... < tn give the buckets
+# "< t1", "t1 to < t2", ..., ">= tn"; counties without the measure are left out, as are empty buckets.
+# INPUT: list of County Demographic objects, group of the measure (e.g. "Education"), key within the group,
+#        list of thresholds
+# OUTPUT: dictionary of bucket label -> counties in that bucket, in ascending order
+def group_by_bucket(counties : list[data.CountyDemographics], group : str, key : str,
+                    thresholds : list[float]) -> dict[str, list[data.CountyDemographics]]:
+    thresholds = sorted(float(threshold) for threshold in thresholds)
+    if not thresholds:
+        raise ValueError("Error: Invalid input.")
+    selection = county_table.selection_of(counties)
+    if selection is not None:
+        return selection.group_by_buckets(county_table.measure_name(group, key), thresholds)
+    labels = ["< {}".format(thresholds[0])] + \
+             ["{} to < {}".format(low, high) for low, high in zip(thresholds, thresholds[1:])] + \
+             [">= {}".format(thresholds[-1])]
+    buckets = [[] for _ in labels]
+    attribute = county_table.GROUPS.get(group)
+    for county in counties:
+        values = getattr(county, attribute) if attribute is not None else {}
+        if key in values:
+            buckets[bisect.bisect_right(thresholds, values[key])].append(county)
+    return {label: bucket for label, bucket in zip(labels, buckets) if bucket}
+
 # This function commits a specified data analysis operation through a given list of counties given a prompt from line,
 # printing the analyzed data
 # INPUT: str representing line of instructions, list of counties
 # OUTPUT: None
 def run_operations(stats : list[data.CountyDemographics], line : str) -> None:
-    value = 0.0
-    operation = "DEFAULT"
-    key = "DEFAULT"
-    measure = "DEFAULT"
-
-    if ":" not in line:
-        operation = line.strip()
-    elif "-" not in line:
-        operation = line[:line.find(":") + 1]
-        measure = line[line.find(":") + 1:line.find(".")]
-        key = line[line.find(".") + 1:].strip()
-
-    if operation not in operations or key not in keys:
-        raise ValueError("Error: Invalid input.")
-    if operation == "population-total":
-        print("2014 Population:", population_list(stats))
-    elif operation == 'population:':
-        # print("pop yuhh")
-        if "Ethnicities" in line:
-            value = population_by_ethnicity(stats, key)
-        elif "Education" in line:
-            value = population_by_education(stats, key)
-        elif key == "Persons Below Poverty Level":
-            value = population_below_poverty_level(stats)
-        print("2014", measure, key, ": ", value)
-    elif operation == 'percent:':
-        # print("percent yuhh")
-        if "Ethnicities" in line:
-            value = percent_by_ethnicity(stats, key)
-        elif "Education" in line:
-            value = percent_by_education(stats, key)
-        elif key == "Persons Below Poverty Level":
-            value = percent_below_poverty_level(stats)
-        print("2014", measure, key, ": ", value, "%")
-    elif operation == "display":
-        for county in stats:
-            print("[",county.county,"]")
-            print("\tPOPULATION:",county.population['2014 Population'])
-            print ("\tAGE")
-            for age in county.age:
-                print("\t\t",age,":",county.age[age],"%")
-            print("\tEDUCATION")
-            for edu in county.education:
-                print("\t\t", edu, ":", county.education[edu], "%")
-            print("\tETHNICITIES")
-            for eth in county.ethnicities:
-                print("\t\t", eth,":", county.ethnicities[eth],"%")
-            print("\tINCOME")
-            for income in county.income:
-                if income == 'Persons Below Poverty Level':
-                    print("\t\t", income, ":", county.income[income],"%")
-                else: print("\t\t", income, ":", county.income[income])
+    execute_step(stats, ops_plan.Step(0, line, ops_plan.parse_operation(line)))
 
 # This function filters through a given list of counties given a prompt from line
 # INPUT: str representing line of instructions, list of counties being filtered
 # OUTPUT: filtered list of counties
 def filter_data(stats : list[data.CountyDemographics], line : str) -> list[data.CountyDemographics]:
-    first_colon_index = line.find(":") + 1
-    filter = line[line.find("-") + 1:first_colon_index]
-    new_stats = 0
-    if filter not in filters:
-        raise ValueError("Error: Invalid input.")
+    return execute_step(stats, ops_plan.Step(0, line, ops_plan.parse_filter(line)))
+
+# This function computes the value of a population-total, population: or percent: line over a given list of counties
+# INPUT: list of counties, ops_plan.PopulationTotal or ops_plan.Aggregate node, optional aggregate.Aggregator over the
+#        same counties (e.g. shared by an aggregate stage)
+# OUTPUT: the total population, sub-population or percentage (0.0 when the line names no measure)
+def aggregate_value(stats : list[data.CountyDemographics], node, aggregator : aggregate.Aggregator | None = None) -> float:
+    if aggregator is None:
+        aggregator = aggregate.Aggregator.over(stats)
+    if aggregator is not None:
+        if isinstance(node, ops_plan.PopulationTotal):
+            return aggregator.total()
+        if node.target is None:
+            return 0.0
+        measure = county_table.measure_name(node.target, node.key)
+        return aggregator.population(measure) if node.kind == "population:" else aggregator.percent(measure)
+    if isinstance(node, ops_plan.PopulationTotal):
+        return population_list(stats)
+    value = 0.0
+    if node.kind == "population:":
+        if node.target == "Ethnicities":
+            value = population_by_ethnicity(stats, node.key)
+        elif node.target == "Education":
+            value = population_by_education(stats, node.key)
+        elif node.target == "Income":
+            value = population_below_poverty_level(stats)
+    else:
+        if node.target == "Ethnicities":
+            value = percent_by_ethnicity(stats, node.key)
+        elif node.target == "Education":
+            value = percent_by_education(stats, node.key)
+        elif node.target == "Income":
+            value = percent_below_poverty_level(stats)
+    return value
 
-    if filter == "state:":
-            state = line[line.find(":") + 1:].strip()
-            new_stats = filter_by_state(stats, state)
-            print("[FILTER] State -> {} (Entries: {})".format(state, len(new_stats)))
+# This function prints the result of a population-total, population: or percent: line
+# INPUT: ops_plan.PopulationTotal or ops_plan.Aggregate node, its value, optional label printed first (e.g. "[CA]")
+# OUTPUT: None
+def print_aggregate(node, value : float, *label : str) -> None:
+    if isinstance(node, ops_plan.PopulationTotal):
+        print(*label, "2014 Population:", value)
+    elif node.kind == "population:":
+        print(*label, "2014", node.measure, node.key, ": ", value)
     else:
-        threshold = float(line[line.find(":", first_colon_index) + 1:].strip())
-        measure = line[line.find(":") + 1:line.find(".")]
-        key = line[line.find(".") + 1:line.find(":", first_colon_index)].strip()
-        if filter == "gt:":
-            if "Ethnicities" in line:
-                new_stats = ethnicity_greater_than(stats, key, threshold)
-            elif "Education" in line:
-                new_stats = education_greater_than(stats, key, threshold)
-            elif key == "Persons Below Poverty Level":
-                new_stats = below_poverty_level_greater_than(stats, threshold)
-        elif filter == "lt:":
-            if "Ethnicities" in line:
-                new_stats = ethnicity_less_than(stats, key, threshold)
-            elif "Education" in line:
-                new_stats = education_less_than(stats, key, threshold)
-            elif key == "Persons Below Poverty Level":
-                new_stats = below_poverty_level_less_than(stats, threshold)
-        print("[FILTER] {} -> {}, {} {} ({} entries)".format(measure, key, filter, threshold, len(new_stats)))
-    return new_stats
+        print(*label, "2014", node.measure, node.key, ": ", value, "%")
 
-def main():
-    file = "inputs/"+sys.argv[1]
+# This function applies a filter line (an ops_plan node) to a given list of counties
+# INPUT: list of counties, ops_plan.StateFilter or ops_plan.ThresholdFilter node
+# OUTPUT: the counties that pass the filter
+def filter_counties(stats : list[data.CountyDemographics], node) -> list[data.CountyDemographics]:
+    if isinstance(node, ops_plan.StateFilter):
+        return filter_by_state(stats, node.state)
+    if node.target == "Ethnicities":
+        compare = ethnicity_greater_than if node.comparison == "gt:" else ethnicity_less_than
+        return compare(stats, node.key, node.threshold)
+    if node.target == "Education":
+        compare = education_greater_than if node.comparison == "gt:" else education_less_than
+        return compare(stats, node.key, node.threshold)
+    compare = below_poverty_level_greater_than if node.comparison == "gt:" else below_poverty_level_less_than
+    return compare(stats, node.threshold)
+
+# This function prints the result of a filter line
+# INPUT: ops_plan.StateFilter or ops_plan.ThresholdFilter node, number of counties left after it
+# OUTPUT: None
+def print_filter(node, entries : int) -> None:
+    if isinstance(node, ops_plan.StateFilter):
+        print("[FILTER] State -> {} (Entries: {})".format(node.state, entries))
+    else:
+        print("[FILTER] {} -> {}, {} {} ({} entries)".format(node.measure, node.key, node.comparison, node.threshold,
+                                                             entries))
+
+# This function runs one parsed line (an ops_plan node) against a given list of counties, printing its results
+# INPUT: list of counties, plan node, output format of display ("text", "csv" or "jsonl"), optional
+#        aggregate.Aggregator over the counties for population-total, population: and percent: lines
+# OUTPUT: the counties after the node runs (a filtered list for filters, otherwise the same counties)
+def execute(stats : list[data.CountyDemographics], node, display_format : str = render.TEXT,
+            aggregator : aggregate.Aggregator | None = None) -> list[data.CountyDemographics]:
+    if isinstance(node, ops_plan.Invalid):
+        raise ValueError("Error: Invalid input.")
+    if isinstance(node, (ops_plan.StateFilter, ops_plan.ThresholdFilter)):
+        new_stats = filter_counties(stats, node)
+        print_filter(node, len(new_stats))
+        return new_stats
+    if isinstance(node, (ops_plan.PopulationTotal, ops_plan.Aggregate)):
+        print_aggregate(node, aggregate_value(stats, node, aggregator))
+    elif isinstance(node, ops_plan.GroupBy):
+        if node.by == "state":
+            groups = group_by_state(stats)
+        else:
+            groups = group_by_bucket(stats, node.measure, node.key, node.thresholds)
+        for label, counties in groups.items():
+            print_aggregate(node.aggregate, aggregate_value(counties, node.aggregate), "[{}]".format(label))
+    elif isinstance(node, ops_plan.Display):
+        render.display(stats, display_format)
+    return stats
+
+# This function runs one line of a script, reporting it to the active profiler when profiling is on
+# INPUT: list of counties, ops_plan.Step, output format of display, optional aggregate.Aggregator over the counties
+# OUTPUT: the counties after the line runs
+def execute_step(stats : list[data.CountyDemographics], step : ops_plan.Step, display_format : str = render.TEXT,
+                 aggregator : aggregate.Aggregator | None = None) -> list[data.CountyDemographics]:
+    tracer = ops_trace.active
+    if tracer is None:
+        return execute(stats, step.node, display_format, aggregator)
+    return tracer.run(execute, stats, step, display_format, aggregator)
+
+# This function runs a compiled .ops script against a given list of counties, reporting any line that fails
+# INPUT: list of counties, ops_plan.Plan, output format of display
+# OUTPUT: the counties left after the script's filters
+def run_plan(stats : list[data.CountyDemographics], plan : ops_plan.Plan,
+             display_format : str = render.TEXT) -> list[data.CountyDemographics]:
+    for stage in plan.stages:
+        aggregator = None
+        if stage.kind == ops_plan.AGGREGATE_STAGE:
+            # Every aggregate in the stage reads the same selection, so they share one aggregator.
+            aggregator = aggregate.Aggregator.over(stats)
+        for step in stage.steps:
+            try:
+                stats = execute_step(stats, step, display_format, aggregator)
+            except:
+                print("An Error occurred. (@ line {}: {})".format(step.number, step.text.strip()))
+    return stats
+
+# This function runs one .ops file against the full data set, printing its results
+# INPUT: str path of the .ops file, output format of display ("text", "csv" or "jsonl")
+# OUTPUT: None
+def run_file(file : str, display_format : str = render.TEXT) -> None:
     print(file)
 
     with open(file, 'r') as infile:
 
+        full_data = build_data.get_data()
         print(len(full_data), "records loaded.")
 
-        stats = full_data
-        count = 0
-        for line in infile:
-            count +=1
-            try:
-                if "filter" in line:
-                    stats = filter_data(stats,line)
-                else:
-                    run_operations(stats, line)
-            except:
-                print("An Error occurred. (@ line {}: {})".format(count,line.strip()))
+        plan = ops_plan.compile_source(infile.read())
+        if ops_trace.active is None:
+            run_plan(full_data, plan, display_format)
+        else:
+            with ops_trace.active.span(file):
+                run_plan(full_data, plan, display_format)
+
+# Usage: python hw4.py FILE.ops [text|csv|jsonl]
+# Set OPS_PROFILE=summary (table on stderr) and/or OPS_PROFILE=FILE.json (Chrome trace) to profile every line.
+def main():
+    with ops_trace.from_environment():
+        run_file("inputs/"+sys.argv[1], *sys.argv[2:3])
 
 if __name__ == '__main__':
 
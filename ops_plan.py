@@ -0,0 +1,241 @@
+import hashlib
+import io
+import re
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+# The operations, keys and filters an .ops line may name. Lines are checked
+# against these exactly as the original interpreter did, including the
+# "DEFAULT" placeholders a line that names no operation or key falls back to.
+OPERATIONS = frozenset(["DEFAULT", "population-total", "population:", "percent:", "display", "gt:", "lt:", "state"])
+KEYS = frozenset(["DEFAULT", "Bachelor's Degree or Higher", "High School or Higher",
+                  "American Indian and Alaska Native Alone", "Asian Alone", "Black Alone", "Hispanic or Latino",
+                  "Native Hawaiian and Other Pacific Islander Alone", "Two or More Races", "White Alone",
+                  "White Alone, not Hispanic or Latino", "Persons Below Poverty Level"])
+FILTERS = frozenset(["state:", "lt:", "gt:"])
+
+POVERTY = "Persons Below Poverty Level"
+
+
+# Plan nodes. Each is the typed form of one .ops line.
+
+# filter-state:XX
+class StateFilter(NamedTuple):
+    state: str
+
+
+# filter-gt:Group.Key:N or filter-lt:Group.Key:N
+class ThresholdFilter(NamedTuple):
+    comparison: str     # "gt:" or "lt:"
+    measure: str        # the group as written, e.g. "Education"
+    key: str
+    threshold: float
+    target: str         # the group filtered on: "Ethnicities", "Education" or "Income"
+
+
+# population-total
+class PopulationTotal(NamedTuple):
+    pass
+
+
+# population:Group.Key or percent:Group.Key
+class Aggregate(NamedTuple):
+    kind: str           # "population:" or "percent:"
+    measure: str        # the group as written, e.g. "Education"
+    key: str
+    target: str | None  # the group aggregated, or None when the line names none (the result is 0.0)
+
+
+# groupby-state AGGREGATE or groupby-bucket:Group.Key:T1,T2,... AGGREGATE, where
+# AGGREGATE is a population-total, population: or percent: line
+class GroupBy(NamedTuple):
+    by: str                   # "state" or "bucket"
+    measure: str              # for buckets, the group as written, e.g. "Education"
+    key: str                  # for buckets, the key bucketed on
+    thresholds: tuple[float, ...]
+    aggregate: NamedTuple     # PopulationTotal or Aggregate
+
+
+# display
+class Display(NamedTuple):
+    pass
+
+
+# A valid line that has no effect (e.g. "state" or "gt:...").
+class NoOp(NamedTuple):
+    pass
+
+
+# A line that fails when run. It still occupies its place in the plan so the
+# error is reported in order.
+class Invalid(NamedTuple):
+    reason: str
+
+
+# One line of a script: its 1-based line number, its text and its node.
+class Step(NamedTuple):
+    number: int
+    text: str
+    node: NamedTuple
+
+
+# Stage kinds. A stage groups consecutive steps that run together.
+FILTER_STAGE = "filter"
+AGGREGATE_STAGE = "aggregate"
+SINGLE_STAGE = "single"
+
+
+class Stage(NamedTuple):
+    kind: str
+    steps: tuple[Step, ...]
+
+
+class Plan(NamedTuple):
+    steps: tuple[Step, ...]
+    stages: tuple[Stage, ...]
+
+
+# Returns the group a line refers to, checked in the same order the original
+# interpreter used.
+def _target(line: str, key: str) -> str | None:
+    if "Ethnicities" in line:
+        return "Ethnicities"
+    if "Education" in line:
+        return "Education"
+    if key == POVERTY:
+        return "Income"
+    return None
+
+
+# Parses a filter line.
+# input: str representing a line of instructions, e.g. "filter-state:CA"
+# output: StateFilter, ThresholdFilter or Invalid
+def parse_filter(line: str) -> NamedTuple:
+    first_colon_index = line.find(":") + 1
+    filter = line[line.find("-") + 1:first_colon_index]
+    if filter not in FILTERS:
+        return Invalid("unknown filter")
+    if filter == "state:":
+        return StateFilter(line[line.find(":") + 1:].strip())
+    try:
+        threshold = float(line[line.find(":", first_colon_index) + 1:].strip())
+    except ValueError:
+        return Invalid("threshold is not a number")
+    measure = line[line.find(":") + 1:line.find(".")]
+    key = line[line.find(".") + 1:line.find(":", first_colon_index)].strip()
+    target = _target(line, key)
+    if target is None:
+        return Invalid("no measure to filter on")
+    return ThresholdFilter(filter, measure, key, threshold, target)
+
+
+# Parses a non-filter line.
+# input: str representing a line of instructions, e.g. "percent:Education.High School or Higher"
+# output: PopulationTotal, Aggregate, Display, NoOp or Invalid
+def parse_operation(line: str) -> NamedTuple:
+    operation = "DEFAULT"
+    key = "DEFAULT"
+    measure = "DEFAULT"
+
+    if ":" not in line:
+        operation = line.strip()
+    elif "-" not in line:
+        operation = line[:line.find(":") + 1]
+        measure = line[line.find(":") + 1:line.find(".")]
+        key = line[line.find(".") + 1:].strip()
+
+    if operation not in OPERATIONS or key not in KEYS:
+        return Invalid("unknown operation or key")
+    if operation == "population-total":
+        return PopulationTotal()
+    if operation in ("population:", "percent:"):
+        return Aggregate(operation, measure, key, _target(line, key))
+    if operation == "display":
+        return Display()
+    return NoOp()
+
+
+_GROUP_BY_STATE = re.compile(r"groupby-state\s+(?P<aggregate>.*)", re.DOTALL)
+_GROUP_BY_BUCKET = re.compile(r"groupby-bucket:(?P<measure>[^.]*)\.(?P<key>.*):(?P<thresholds>[-+0-9.eE, ]+?)"
+                              r"\s+(?P<aggregate>(population-total|population:|percent:).*)", re.DOTALL)
+
+
+# Parses a group-by line.
+# input: str representing a line of instructions, e.g. "groupby-state percent:Income.Persons Below Poverty Level"
+# output: GroupBy or Invalid
+def parse_group_by(line: str) -> NamedTuple:
+    match = _GROUP_BY_STATE.fullmatch(line.strip())
+    if match is not None:
+        by, measure, key, thresholds = "state", "DEFAULT", "DEFAULT", ()
+    else:
+        match = _GROUP_BY_BUCKET.fullmatch(line.strip())
+        if match is None:
+            return Invalid("unknown group-by")
+        by, measure, key = "bucket", match["measure"], match["key"].strip()
+        try:
+            thresholds = tuple(sorted(float(threshold) for threshold in match["thresholds"].split(",")))
+        except ValueError:
+            return Invalid("threshold is not a number")
+    aggregate = parse_operation(match["aggregate"])
+    if not isinstance(aggregate, (PopulationTotal, Aggregate)):
+        return Invalid("group-by needs a population-total, population: or percent: operation")
+    return GroupBy(by, measure, key, thresholds, aggregate)
+
+
+# Parses any line of an .ops script.
+# input: str representing a line of instructions
+# output: plan node for the line
+def parse_line(line: str) -> NamedTuple:
+    if "filter" in line:
+        return parse_filter(line)
+    if line.startswith("groupby-"):
+        return parse_group_by(line)
+    return parse_operation(line)
+
+
+# Groups consecutive steps into stages: runs of filters are fused into one
+# filter stage and runs of population-total/population:/percent: lines into
+# one aggregate stage, so each run is evaluated against a single selection.
+# Filters keep their written order because every filter line reports the
+# number of entries left at that point.
+# input: steps of a script, in order
+# output: tuple of stages
+def plan_stages(steps: list[Step]) -> tuple[Stage, ...]:
+    stages = []
+    for step in steps:
+        if isinstance(step.node, (StateFilter, ThresholdFilter)):
+            kind = FILTER_STAGE
+        elif isinstance(step.node, (PopulationTotal, Aggregate)):
+            kind = AGGREGATE_STAGE
+        else:
+            kind = SINGLE_STAGE
+        if kind != SINGLE_STAGE and stages and stages[-1].kind == kind:
+            stages[-1] = Stage(kind, stages[-1].steps + (step,))
+        else:
+            stages.append(Stage(kind, (step,)))
+    return tuple(stages)
+
+
+# Compiled plans by the SHA-256 of their script, least recently used first.
+_PLAN_CACHE_SIZE = 128
+_plans = OrderedDict()
+
+
+# Compiles the text of an .ops script into a plan, reusing the plan compiled
+# earlier for identical text.
+# input: the full text of the script
+# output: Plan
+def compile_source(text: str) -> Plan:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    plan = _plans.get(digest)
+    if plan is not None:
+        _plans.move_to_end(digest)
+        return plan
+    steps = [Step(number, line, parse_line(line))
+             for number, line in enumerate(io.StringIO(text), start=1)]
+    plan = Plan(tuple(steps), plan_stages(steps))
+    _plans[digest] = plan
+    if len(_plans) > _PLAN_CACHE_SIZE:
+        _plans.popitem(last=False)
+    return plan
@@ -0,0 +1,197 @@
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import NamedTuple
+
+import result_cache
+
+
+# What one .ops line cost.
+class LineProfile(NamedTuple):
+    number: int                 # line number in the script (0 outside a script)
+    text: str
+    operation: str              # the line's plan node, e.g. "ThresholdFilter"
+    start: int                  # nanoseconds since the tracer started
+    duration: int               # nanoseconds
+    rows_in: int
+    rows_out: int | None        # None when the line failed
+    allocated: int | None       # net bytes allocated by the line (None without tracemalloc)
+    peak: int | None            # peak bytes above the line's starting point
+    cache_hits: int
+    cache_misses: int
+    error: str | None           # exception type name when the line failed
+
+
+# A span around something bigger than a line, e.g. one script.
+class Span(NamedTuple):
+    name: str
+    category: str
+    start: int
+    duration: int
+
+
+# Records a LineProfile for every .ops line the interpreter runs while it is
+# the active tracer. The interpreter only checks whether a tracer is active,
+# so none of this costs anything when profiling is off.
+class Tracer:
+    # Initialize a new Tracer.
+    # input: whether to measure allocations with tracemalloc (which must be tracing)
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.lines = []
+        self.spans = []
+        self._origin = time.perf_counter_ns()
+
+    # Runs one line and records what it cost.
+    # input: the function running the node (hw4.execute), the counties, the
+    #        ops_plan.Step, any further arguments to the function
+    # output: whatever the function returns
+    def run(self, execute, stats, step, *arguments):
+        rows_in = len(stats)
+        cache = result_cache.results
+        hits, misses = cache.hits, cache.misses
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        result = None
+        error = None
+        start = time.perf_counter_ns()
+        try:
+            result = execute(stats, step.node, *arguments)
+            return result
+        except BaseException as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            stop = time.perf_counter_ns()
+            allocated = peak = None
+            if self.memory:
+                current, highest = tracemalloc.get_traced_memory()
+                allocated, peak = current - before, highest - before
+            self.lines.append(LineProfile(
+                step.number, step.text.rstrip("\n"), type(step.node).__name__,
+                start - self._origin, stop - start,
+                rows_in, None if error is not None else len(result),
+                allocated, peak, cache.hits - hits, cache.misses - misses, error))
+
+    # Records a span around a block, such as one whole script.
+    # input: span name, category
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "script"):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            stop = time.perf_counter_ns()
+            self.spans.append(Span(name, category, start - self._origin, stop - start))
+
+    # Returns the recorded lines as a table, one row per line plus a total.
+    # input: no input
+    # output: the table as text
+    def summary(self) -> str:
+        def kib(value):
+            return "-" if value is None else "{:.1f}".format(value / 1024)
+
+        rows = ["{:>5}  {:<16} {:>10} {:>9} {:>9} {:>7} {:>10} {:>10} {:>9}  {}".format(
+            "line", "operation", "ms", "rows in", "rows out", "kept %", "alloc KiB", "peak KiB", "hit/miss", "text")]
+        for line in self.lines:
+            text = line.text
+            if line.rows_out is None:
+                rows_out, kept = "error", "-"
+                text += "  [{}]".format(line.error)
+            else:
+                rows_out = line.rows_out
+                kept = "{:.1f}".format(100 * line.rows_out / line.rows_in) if line.rows_in else "-"
+            rows.append("{:>5}  {:<16} {:>10.3f} {:>9} {:>9} {:>7} {:>10} {:>10} {:>9}  {}".format(
+                line.number, line.operation, line.duration / 1e6, line.rows_in, rows_out, kept,
+                kib(line.allocated), kib(line.peak), "{}/{}".format(line.cache_hits, line.cache_misses),
+                text))
+        total = sum(line.duration for line in self.lines)
+        hits = sum(line.cache_hits for line in self.lines)
+        misses = sum(line.cache_misses for line in self.lines)
+        rows.append("{:>5}  {:<16} {:>10.3f} {:>9} {:>9} {:>7} {:>10} {:>10} {:>9}".format(
+            "", "total", total / 1e6, "", "", "", "", "", "{}/{}".format(hits, misses)))
+        return "\n".join(rows) + "\n"
+
+    # Returns the recorded spans and lines as Chrome trace events, viewable
+    # in chrome://tracing or Perfetto.
+    # input: no input
+    # output: trace dictionary ready for json.dump
+    def trace_events(self) -> dict:
+        pid = os.getpid()
+        events = [{"name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": 0,
+                   "ts": span.start / 1000, "dur": span.duration / 1000}
+                  for span in self.spans]
+        for line in self.lines:
+            events.append({
+                "name": "{}: {}".format(line.number, line.text), "cat": line.operation, "ph": "X",
+                "pid": pid, "tid": 0, "ts": line.start / 1000, "dur": line.duration / 1000,
+                "args": {"rows_in": line.rows_in, "rows_out": line.rows_out,
+                         "allocated": line.allocated, "peak": line.peak,
+                         "cache_hits": line.cache_hits, "cache_misses": line.cache_misses,
+                         "error": line.error},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # Writes the Chrome trace events to a file.
+    # input: path of the JSON file
+    # output: None
+    def write_trace(self, path: str) -> None:
+        with open(path, "w") as outfile:
+            json.dump(self.trace_events(), outfile)
+
+
+# The tracer the interpreter reports to, or None when profiling is off.
+active = None
+
+
+# Profiles every .ops line run inside the block. When the block ends, the
+# summary table and the Chrome trace are written where requested.
+# input: stream for the summary table (None for no table), path for the
+#        Chrome trace (None for no trace), whether to measure allocations
+# output: context manager yielding the Tracer
+@contextlib.contextmanager
+def profiling(summary=None, trace_path: str | None = None, memory: bool = True):
+    global active
+    tracer = Tracer(memory)
+    previous = active
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    active = tracer
+    try:
+        yield tracer
+    finally:
+        active = previous
+        if started:
+            tracemalloc.stop()
+        if summary is not None:
+            summary.write(tracer.summary())
+        if trace_path is not None:
+            tracer.write_trace(trace_path)
+
+
+# Profiling as configured by the environment, so a script can be profiled
+# without changing how it is run:
+#   OPS_PROFILE=summary            summary table on stderr
+#   OPS_PROFILE=trace.json         Chrome trace written to trace.json
+#   OPS_PROFILE=summary,trace.json both
+#   OPS_PROFILE_MEMORY=0           skip tracemalloc (faster, no allocation columns)
+# input: no input
+# output: context manager; does nothing when OPS_PROFILE is unset
+def from_environment():
+    setting = os.environ.get("OPS_PROFILE", "")
+    if not setting:
+        return contextlib.nullcontext()
+    summary = None
+    trace_path = None
+    for target in setting.split(","):
+        if target == "summary":
+            summary = sys.stderr
+        elif target:
+            trace_path = target
+    memory = os.environ.get("OPS_PROFILE_MEMORY", "1") != "0"
+    return profiling(summary, trace_path, memory)
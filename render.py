@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import sys
+from itertools import chain, compress
+
+import county_table
+from county_table import GROUPS
+
+
+# Output formats for the display operation.
+TEXT = "text"
+CSV = "csv"
+JSONL = "jsonl"
+FORMATS = (TEXT, CSV, JSONL)
+
+# How many counties are formatted before the buffer is written out.
+CHUNK_ROWS = 256
+
+POVERTY = "Persons Below Poverty Level"
+
+
+# Yields every county as (county name, state, {group: [(key, value), ...]}).
+# Counties backed by a CountyTable are read straight from its columns;
+# anything else is read through the CountyDemographics attributes.
+# input: a CountyTable, a Selection, or a list of CountyDemographics
+# output: generator of row tuples, in the counties' order
+def rows(counties):
+    located = county_table.locate(counties)
+    if located is None:
+        for county in counties:
+            yield (county.county, county.state,
+                   {group: list(getattr(county, attribute).items()) for group, attribute in GROUPS.items()})
+        return
+    table, selected = located
+    if isinstance(selected, (bytes, bytearray)):
+        selected = compress(range(len(selected)), selected)
+    columns = table.columns
+    for row in selected:
+        yield (table.county_of(row), table.state_of(row),
+               {group: [(key, columns[county_table.measure_name(group, key)][row])
+                        for key in table.keys_of(group, row)]
+                for group in GROUPS})
+
+
+# Formats one county exactly as the display operation has always printed it.
+# input: row tuple from rows()
+# output: the county's lines, each ending in a newline
+def format_text(row) -> str:
+    county, _, groups = row
+    population = dict(groups['Population'])['2014 Population']
+    parts = ["[ ", str(county), " ]\n\tPOPULATION: ", str(population), "\n\tAGE\n"]
+    for key, value in groups['Age']:
+        parts.append("\t\t {} : {} %\n".format(key, value))
+    parts.append("\tEDUCATION\n")
+    for key, value in groups['Education']:
+        parts.append("\t\t {} : {} %\n".format(key, value))
+    parts.append("\tETHNICITIES\n")
+    for key, value in groups['Ethnicities']:
+        parts.append("\t\t {} : {} %\n".format(key, value))
+    parts.append("\tINCOME\n")
+    for key, value in groups['Income']:
+        if key == POVERTY:
+            parts.append("\t\t {} : {} %\n".format(key, value))
+        else:
+            parts.append("\t\t {} : {}\n".format(key, value))
+    return "".join(parts)
+
+
+# Formats one county as a JSON Lines record.
+# input: row tuple from rows()
+# output: one JSON object followed by a newline
+def format_jsonl(row) -> str:
+    county, state, groups = row
+    record = {"county": county, "state": state}
+    for group, attribute in GROUPS.items():
+        record[attribute] = dict(groups[group])
+    return json.dumps(record) + "\n"
+
+
+# Returns the CSV columns: county, state, then every measure of the groups
+# (group -> keys), or of the first row when the groups are not known.
+def _csv_header(groups: dict[str, list[str]] | None, first) -> list[str]:
+    if groups is None:
+        groups = {group: [key for key, _ in first[2][group]] for group in GROUPS}
+    return ["county", "state"] + [county_table.measure_name(group, key)
+                                  for group in GROUPS for key in groups[group]]
+
+
+# Yields the display output for the counties in chunks of formatted text.
+# input: counties to display, output format, counties per chunk
+# output: generator of strings
+def chunks(counties, format: str = TEXT, chunk_rows: int = CHUNK_ROWS):
+    groups = None
+    if format == CSV:
+        located = county_table.locate(counties)
+        if located is not None:
+            groups = located[0].groups
+    yield from format_rows(rows(counties), format, chunk_rows, groups)
+
+
+# Yields the display output for a stream of row tuples in chunks of
+# formatted text.
+# input: row tuples as from rows(), output format, counties per chunk, the
+#        table's groups for the CSV columns (None to take them from the first row)
+# output: generator of strings
+def format_rows(stream, format: str = TEXT, chunk_rows: int = CHUNK_ROWS, groups: dict[str, list[str]] | None = None):
+    if format not in FORMATS:
+        raise ValueError("Error: Invalid input.")
+    stream = iter(stream)
+    if format == CSV:
+        first = next(stream, None)
+        if first is None:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        header = _csv_header(groups, first)
+        writer.writerow(header)
+        written = 0
+        for row in chain([first], stream):
+            values = {county_table.measure_name(group, key): value
+                      for group, items in row[2].items() for key, value in items}
+            writer.writerow([row[0], row[1]] + [values.get(name, "") for name in header[2:]])
+            written += 1
+            if written % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+    formatter = format_text if format == TEXT else format_jsonl
+    parts = []
+    for row in stream:
+        parts.append(formatter(row))
+        if len(parts) == chunk_rows:
+            yield "".join(parts)
+            parts = []
+    if parts:
+        yield "".join(parts)
+
+
+# Writes the display output for the counties. Text is built in chunks and
+# written with one call per chunk instead of a print per line; the text
+# format is byte-for-byte what the display operation has always printed.
+# input: counties to display, output format, stream (default sys.stdout),
+#        counties per chunk, whether to flush the stream after every chunk
+# output: None
+def display(counties, format: str = TEXT, stream=None, chunk_rows: int = CHUNK_ROWS, flush: bool = False) -> None:
+    if stream is None:
+        stream = sys.stdout
+    for chunk in chunks(counties, format, chunk_rows):
+        stream.write(chunk)
+        if flush:
+            stream.flush()
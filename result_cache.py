@@ -0,0 +1,130 @@
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+# The size counted for a value without an nbytes attribute (a number, a
+# small tuple), roughly what its entry, key included, costs in memory.
+ENTRY_BYTES = 128
+
+
+# Returns the approximate memory held by a cached value: its nbytes
+# attribute when it has one (see county_table.Selection), else ENTRY_BYTES.
+def size_of(value) -> int:
+    return getattr(value, 'nbytes', ENTRY_BYTES)
+
+
+# A bounded least-recently-used cache with hit, miss and eviction counters.
+# It is bounded both by its number of entries and, optionally, by the
+# approximate bytes its values hold, since one cached selection of a large
+# table can cost as much as thousands of cached numbers.
+class LRUCache:
+    # Initialize a new LRUCache.
+    # input: the most entries kept before the least recently used is evicted
+    # input: the most bytes (by size_of) kept, or None for no byte bound
+    def __init__(self, maxsize: int = 1024, maxbytes: int | None = None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+
+    # Returns the cached value for a key, computing and caching it on a miss.
+    # input: hashable key, function of no arguments producing the value
+    # output: the cached or newly computed value
+    def get_or_compute(self, key, compute):
+        value = self._entries.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+        self.misses += 1
+        value = compute()
+        size = size_of(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return value
+        self._entries[key] = value
+        self._sizes[key] = size
+        self.bytes += size
+        self._evict()
+        return value
+
+    # Evicts least recently used entries until both bounds are met.
+    def _evict(self) -> None:
+        while len(self._entries) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+            key, _ = self._entries.popitem(last=False)
+            self.bytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    # Removes every entry whose key satisfies a predicate (every entry if none).
+    # input: optional function of a key returning True to drop it
+    # output: None
+    def clear(self, predicate=None) -> None:
+        if predicate is None:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+            return
+        for key in [key for key in self._entries if predicate(key)]:
+            self.discard(key)
+
+    # Returns every entry, least recently used first, without counting hits.
+    # input: no input
+    # output: list of (key, value) pairs
+    def entries(self) -> list[tuple]:
+        return list(self._entries.items())
+
+    # Replaces the value of an entry, keeping its place in the eviction order.
+    # input: key of an existing entry, its new value
+    # output: None
+    def replace(self, key, value) -> None:
+        if key in self._entries:
+            self._entries[key] = value
+            size = size_of(value)
+            self.bytes += size - self._sizes[key]
+            self._sizes[key] = size
+            self._evict()
+
+    # Removes one entry if present.
+    # input: key
+    # output: None
+    def discard(self, key) -> None:
+        if self._entries.pop(key, _MISSING) is not _MISSING:
+            self.bytes -= self._sizes.pop(key)
+
+    # Changes the bounds, evicting entries if the cache is now too big.
+    # input: the new maximum number of entries
+    # input: the new maximum bytes, or None for no byte bound
+    # output: None
+    def resize(self, maxsize: int, maxbytes: int | None = None) -> None:
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._evict()
+
+    # Returns the cache's counters.
+    # input: no input
+    # output: dictionary of hits, misses, evictions, size, maxsize, bytes and maxbytes
+    def stats(self) -> dict[str, int | None]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'bytes': self.bytes,
+            'maxbytes': self.maxbytes,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# The shared cache of filtered selections and aggregate results. Keys start
+# with the token of the table they were computed from, followed by the
+# canonical signature of the filter chain (see county_table.Selection).
+# Each cached selection holds a mask of one byte per row of its table, so
+# the cache is bounded by bytes as well as by entries.
+results = LRUCache(maxbytes=64 * 1024 * 1024)
@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import build_data
+import county_table
+import hw4
+import ops_plan
+import render
+
+
+# The longest request line accepted, well above asyncio's 64 KiB default so
+# that a whole script fits in one request.
+REQUEST_LIMIT = 16 * 1024 * 1024
+
+
+# Runs an .ops script (one line or many) against the resident data set.
+# input: script text, whether to return per-line results, display format
+# output: the text the script prints, or with structured=True a list of
+#         {"line", "text", "output", "error"} dictionaries, one per line
+def evaluate(script: str, structured: bool = False, display_format: str = render.TEXT):
+    plan = ops_plan.compile_source(script)
+    stats = build_data.get_data()
+    if not structured:
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            hw4.run_plan(stats, plan, display_format)
+        return buffer.getvalue()
+    results = []
+    for step in plan.steps:
+        buffer = io.StringIO()
+        error = False
+        with contextlib.redirect_stdout(buffer):
+            try:
+                stats = hw4.execute(stats, step.node, display_format)
+            except:
+                error = True
+        results.append({"line": step.number, "text": step.text.rstrip("\n"),
+                        "output": buffer.getvalue(), "error": error})
+    return results
+
+
+# Answers one request. Requests and responses are single lines of JSON:
+#   {"script": "filter-state:CA\npopulation-total", "structured": false, "format": "text"}
+#   -> {"output": "..."} or {"results": [...]}, or {"error": "..."} for a bad
+#   request or one that could not be evaluated
+# input: the request line
+# output: the response line
+def handle(line: bytes) -> bytes:
+    try:
+        request = json.loads(line)
+        script = request["script"]
+        if not isinstance(script, str):
+            raise TypeError("script must be a string")
+        structured = bool(request.get("structured", False))
+        display_format = request.get("format", render.TEXT)
+        if display_format not in render.FORMATS:
+            raise ValueError("unknown format {!r}".format(display_format))
+        result = evaluate(script, structured, display_format)
+        response = {"results": result} if structured else {"output": result}
+    except Exception as error:
+        response = {"error": _describe(error)}
+    return json.dumps(response).encode("utf-8") + b"\n"
+
+
+def _describe(error: Exception) -> str:
+    return str(error) or type(error).__name__
+
+
+def _error_response(error: Exception) -> bytes:
+    return json.dumps({"error": _describe(error)}).encode("utf-8") + b"\n"
+
+
+# Reads the next request line (without a newline at the end of the stream).
+# A line over REQUEST_LIMIT is read through and dropped, so the next request
+# starts cleanly; a client that disconnects partway through it has ended
+# its stream.
+# input: the connection's reader
+# output: the line, or b"" at the end of the stream
+# raises ValueError for a line over the limit
+async def _read_request(reader: asyncio.StreamReader) -> bytes:
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+    except asyncio.LimitOverrunError as error:
+        consumed = error.consumed
+    while True:
+        try:
+            await reader.readexactly(consumed)
+        except asyncio.IncompleteReadError:
+            return b""
+        try:
+            await reader.readuntil(b"\n")
+            break
+        except asyncio.IncompleteReadError:
+            break
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+    raise ValueError("request is longer than {} bytes".format(REQUEST_LIMIT))
+
+
+# The worker processes requests are evaluated in, forked after the data set
+# was loaded. A worker that dies (killed, out of memory) breaks its whole
+# pool, so the first request to see the break replaces the pool with a
+# fresh one and every request caught by it is retried there once. A request
+# that breaks the new pool as well gets an error.
+class Workers:
+    # Initialize a new Workers and start its pool.
+    # input: number of worker processes
+    def __init__(self, count: int):
+        self.count = count
+        self.pool = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        return ProcessPoolExecutor(max_workers=self.count, mp_context=context)
+
+    # Runs a function in a worker process.
+    # input: the function and its arguments
+    # output: what the function returns
+    # raises BrokenProcessPool when the retry's pool breaks too
+    async def run(self, function, *arguments):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self.pool
+            try:
+                return await loop.run_in_executor(pool, function, *arguments)
+            except BrokenProcessPool:
+                if pool is self.pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._start()
+                if attempt:
+                    raise
+
+    # Stops the worker processes.
+    def shutdown(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+
+# Returns a connection handler. With workers, requests are evaluated
+# concurrently in worker processes. Without them they are evaluated on the
+# event loop one at a time (evaluation prints through sys.stdout, so it
+# cannot share a process between threads), and a long request such as a
+# display holds up every other client.
+# Every request gets a response line, an error response if need be.
+def _client_handler(workers: Workers | None):
+    async def serve_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    line = await _read_request(reader)
+                except ValueError as error:
+                    writer.write(_error_response(error))
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    if workers is None:
+                        response = handle(line)
+                    else:
+                        response = await workers.run(handle, line)
+                except Exception as error:
+                    response = _error_response(error)
+                writer.write(response)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return serve_client
+
+
+# Loads the data set and its indexes so that every request runs warm.
+# input: no input
+# output: the resident CountyTable
+def warm() -> county_table.CountyTable:
+    table = build_data.get_data()
+    table.state_index()
+    for group in ("Education", "Ethnicities"):
+        for key in table.groups[group]:
+            table.sorted_index(county_table.measure_name(group, key))
+    table.sorted_index("Income.Persons Below Poverty Level")
+    return table
+
+
+# Serves requests until cancelled.
+# input: Unix socket path, or host and port for TCP, number of worker
+#        processes (None for one per core, at least two; 0 evaluates on the
+#        event loop)
+# output: None
+async def serve(path: str | None = None, host: str = "127.0.0.1", port: int = 8765, workers: int | None = None) -> None:
+    warm()
+    if workers is None:
+        workers = max(os.cpu_count() or 1, 2)
+    pool = Workers(workers) if workers > 0 else None
+    handler = _client_handler(pool)
+    try:
+        if path is not None:
+            server = await asyncio.start_unix_server(handler, path=path, limit=REQUEST_LIMIT)
+        else:
+            server = await asyncio.start_server(handler, host=host, port=port, limit=REQUEST_LIMIT)
+        async with server:
+            await server.serve_forever()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve .ops queries over a local socket.")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket at PATH")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port (default: 8765)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="evaluate requests in this many worker processes (default: one per core, at least two; "
+                             "0 evaluates on the event loop, one request at a time)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.unix, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import array
+import contextlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import county_table
+from county_table import CountyTable
+
+
+# A snapshot is the converted CountyTable written in a form that can be
+# memory-mapped back without any per-record work:
+#
+#   MAGIC, then a little-endian header of (version, metadata length),
+#   then the metadata as UTF-8 JSON, padded to an 8 byte boundary,
+#   then every array segment's raw bytes, each padded to 8 bytes.
+#
+# The metadata records the source file's size and modification time, the
+# string table, group layouts, the state index and where each segment lives.
+# Any mismatch in version, byte order or source makes the snapshot stale.
+MAGIC = b'CDSNAP\x00\x00'
+VERSION = 1
+
+_HEADER = struct.Struct('<IQ')
+_ALIGN = 8
+
+
+# Returns the default snapshot path for a source data file.
+# input: path of the source pickle
+# output: path of its snapshot, alongside it
+def snapshot_path(source: str) -> str:
+    return os.path.splitext(source)[0] + '.snapshot'
+
+
+def _source_stamp(source: str) -> dict:
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _padding(length: int) -> bytes:
+    return bytes(-length % _ALIGN)
+
+
+# Encodes a table in the snapshot format.
+# input: the table, the stamp of the source it was converted from (any JSON
+#        value; read and decode only accept a snapshot with the same stamp)
+# output: the snapshot's bytes, in pieces
+def encode(table: CountyTable, stamp=None) -> list[bytes]:
+    segments = []
+    layout = {}
+    offset = 0
+
+    def add(name, column):
+        nonlocal offset
+        data = memoryview(column).tobytes()
+        layout[name] = [county_table.typecode(column), offset, len(column)]
+        segments.append(data + _padding(len(data)))
+        offset += len(segments[-1])
+
+    add('states', table.states)
+    add('counties', table.counties)
+    for group, ids in table.layout_ids.items():
+        add('layout:' + group, ids)
+    for name, column in table.columns.items():
+        add('column:' + name, column)
+
+    state_rows, state_totals = table.state_index()
+    index = {}
+    start = 0
+    for state, rows in state_rows.items():
+        index[state] = [start, start + len(rows), state_totals.get(state, 0)]
+        start += len(rows)
+    ordered = [row for rows in state_rows.values() for row in rows]
+    add('state_rows', array.array('I', ordered))
+
+    metadata = json.dumps({
+        'source': stamp,
+        'byteorder': sys.byteorder,
+        'groups': table.groups,
+        'strings': table.strings,
+        'layouts': table.layouts,
+        'states': index,
+        'segments': layout,
+    }).encode('utf-8')
+
+    header = MAGIC + _HEADER.pack(VERSION, len(metadata)) + metadata
+    return [header + _padding(len(header))] + segments
+
+
+# Opens a temporary file of its own next to path for writing, and moves it
+# into place when the block ends, so readers never see a partial file and
+# processes writing at once never share one. The file gets the permissions
+# a newly created file would (0666 less the umask), so other users can read
+# it; if the block fails it is removed instead.
+# input: path of the file to write
+# output: context manager yielding the binary file object
+@contextlib.contextmanager
+def atomic_write(path: str):
+    descriptor, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                             dir=os.path.dirname(path) or '.')
+    try:
+        with open(descriptor, 'wb') as outfile:
+            yield outfile
+        os.chmod(temporary, 0o666 & ~_umask())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# Writes a table to a snapshot file with atomic_write.
+# input: the table, the snapshot path, the source file it was converted from,
+#        the source's stamp when the conversion started (default: its stamp now)
+# output: None
+def write(table: CountyTable, path: str, source: str, stamp: dict | None = None) -> None:
+    pieces = encode(table, _source_stamp(source) if stamp is None else stamp)
+    with atomic_write(path) as outfile:
+        for data in pieces:
+            outfile.write(data)
+
+
+# Reads a snapshot, memory-mapping its arrays rather than copying them.
+# input: the snapshot path, the source file it must have been converted from
+# output: CountyTable whose columns are memoryviews over the mapped file, or
+#         None if the snapshot is missing, unreadable or stale
+def read(path: str, source: str) -> CountyTable | None:
+    return _read(path, _source_stamp(source))
+
+
+def _read(path: str, stamp: dict) -> CountyTable | None:
+    try:
+        with open(path, 'rb') as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    return decode(memoryview(mapped), stamp)
+
+
+# Decodes a table in the snapshot format without copying its arrays.
+# input: the snapshot's bytes, the stamp it must have been encoded with
+# output: CountyTable whose columns are memoryviews over the bytes, or None
+#         if the bytes are not a readable snapshot with that stamp
+def decode(view: memoryview, stamp=None) -> CountyTable | None:
+    try:
+        return _map(view, stamp)
+    except (ValueError, KeyError, TypeError, IndexError, struct.error):
+        return None
+
+
+def _map(view: memoryview, stamp) -> CountyTable | None:
+    if view[:len(MAGIC)] != MAGIC:
+        return None
+    version, metadata_length = _HEADER.unpack_from(view, len(MAGIC))
+    if version != VERSION:
+        return None
+    start = len(MAGIC) + _HEADER.size
+    metadata = json.loads(bytes(view[start:start + metadata_length]))
+    if metadata['byteorder'] != sys.byteorder or metadata['source'] != stamp:
+        return None
+    data = start + metadata_length
+    data += -data % _ALIGN
+    rows = metadata['segments']['states'][2]
+
+    # A segment cut short (e.g. a truncated file) or of the wrong length for
+    # the table makes the snapshot unreadable.
+    def segment(name, length=rows):
+        code, offset, stored = metadata['segments'][name]
+        begin = data + offset
+        values = view[begin:begin + stored * struct.calcsize(code)].cast(code)
+        if len(values) != stored or (length is not None and stored != length):
+            raise ValueError('snapshot segment {!r} has the wrong length'.format(name))
+        return values
+
+    groups = metadata['groups']
+    columns = {county_table.measure_name(group, key): segment('column:' + county_table.measure_name(group, key))
+               for group, keys in groups.items() for key in keys}
+    table = CountyTable(
+        groups,
+        columns,
+        segment('states'),
+        segment('counties'),
+        list(map(sys.intern, metadata['strings'])),
+        list(map(tuple, metadata['layouts'])),
+        {group: segment('layout:' + group) for group in groups},
+    )
+    ordered = segment('state_rows', None)
+    if sum(last - first for first, last, _ in metadata['states'].values()) != len(ordered):
+        raise ValueError('snapshot state index has the wrong length')
+    table.restore_state_index(
+        {state: ordered[first:last] for state, (first, last, _) in metadata['states'].items()},
+        {state: total for state, (_, _, total) in metadata['states'].items()},
+    )
+    return table
+
+
+# Returns the table for a source file from its snapshot, converting the source
+# and writing a fresh snapshot when there is none or it is stale. A snapshot
+# that cannot be written (e.g. a read-only directory) is simply skipped.
+# The source is stamped before it is converted, so a source replaced during
+# the conversion leaves a snapshot that is already stale.
+# input: path of the source pickle, function converting it to a CountyTable
+# output: CountyTable
+def load(source: str, convert) -> CountyTable:
+    path = snapshot_path(source)
+    stamp = _source_stamp(source)
+    table = _read(path, stamp)
+    if table is not None:
+        return table
+    table = convert()
+    try:
+        write(table, path, source, stamp)
+    except OSError:
+        pass
+    return table
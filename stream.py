@@ -0,0 +1,505 @@
+import array
+import functools
+import json
+import math
+import operator
+import os
+import pickle
+import struct
+import sys
+from itertools import chain
+
+import aggregate
+import build_data
+import county_table
+import hw4
+import ops_plan
+import render
+import snapshot
+from county_table import CountyTable
+
+
+# A chunked file holds a data set as a run of independent chunks, so that it
+# can be processed one chunk at a time in bounded memory:
+#
+#   MAGIC, then every chunk (a CountyTable of up to chunk_rows counties in
+#   the snapshot format, padded to 8 bytes), then a footer of UTF-8 JSON,
+#   then the footer's length as a little-endian uint64, then MAGIC again.
+#
+# The footer lists where each chunk lives and what the whole data set looks
+# like: every group's keys in first-seen order and each measure's typecode.
+# A chunk is read back with the data set's typecodes and columns, so every
+# value reads exactly as it would from the table get_data builds.
+MAGIC = b'CDCHUNK\x00'
+VERSION = 1
+
+CHUNK_ROWS = 65536
+
+_LENGTH = struct.Struct('<Q')
+
+
+# Writes county records to a chunked file, holding only one chunk of
+# records in memory at a time.
+# input: iterable of county dictionaries in the report's form, path to
+#        write, counties per chunk
+# output: number of counties written
+def write(records, path: str, chunk_rows: int = CHUNK_ROWS) -> int:
+    groups = {group: [] for group in county_table.GROUPS}
+    typecodes = {}
+    chunks = []
+    rows = 0
+
+    def add(outfile, batch):
+        nonlocal rows
+        table = CountyTable.from_records(batch)
+        for group, keys in table.groups.items():
+            seen = set(groups[group])
+            groups[group].extend(key for key in keys if key not in seen)
+        for name, column in table.columns.items():
+            # A column is integral only if it was integral in every chunk,
+            # including chunks where no county had it at all.
+            code = column.typecode if name in typecodes or not chunks else 'd'
+            typecodes[name] = 'd' if typecodes.get(name, code) == 'd' else code
+        for name in typecodes.keys() - table.columns.keys():
+            typecodes[name] = 'd'
+        start = outfile.tell()
+        for data in snapshot.encode(table):
+            outfile.write(data)
+        chunks.append([start, outfile.tell() - start, len(table)])
+        rows += len(table)
+
+    with snapshot.atomic_write(path) as outfile:
+        outfile.write(MAGIC)
+        batch = []
+        for record in records:
+            build_data.fix_income_key(record)
+            batch.append(record)
+            if len(batch) == chunk_rows:
+                add(outfile, batch)
+                batch = []
+        if batch:
+            add(outfile, batch)
+        footer = json.dumps({
+            'version': VERSION,
+            'byteorder': sys.byteorder,
+            'rows': rows,
+            'groups': groups,
+            'typecodes': typecodes,
+            'chunks': chunks,
+        }).encode('utf-8')
+        outfile.write(footer)
+        outfile.write(_LENGTH.pack(len(footer)))
+        outfile.write(MAGIC)
+    return rows
+
+
+# Yields the records of a data file: a CORGIS pickle (which can only be read
+# whole) or JSON Lines, one county per line (read one line at a time).
+# input: path of the data file
+# output: generator of county dictionaries
+def records_from(path: str):
+    if path.endswith('.jsonl'):
+        with open(path) as infile:
+            for line in infile:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(path, 'rb') as infile:
+        yield from pickle.load(infile)
+
+
+# A data set in a chunked file, read one chunk at a time.
+class ChunkedTable:
+    # Initialize a new ChunkedTable, reading the file's footer.
+    # input: path of the chunked file
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as infile:
+            if infile.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a chunked county file'.format(path))
+            infile.seek(-(_LENGTH.size + len(MAGIC)), os.SEEK_END)
+            length, = _LENGTH.unpack(infile.read(_LENGTH.size))
+            if infile.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a chunked county file'.format(path))
+            infile.seek(-(length + _LENGTH.size + len(MAGIC)), os.SEEK_END)
+            footer = json.loads(infile.read(length))
+        if footer['version'] != VERSION or footer['byteorder'] != sys.byteorder:
+            raise ValueError('{} was written by an incompatible version'.format(path))
+        self.rows = footer['rows']
+        self.groups = footer['groups']
+        self.typecodes = footer['typecodes']
+        self.offsets = footer['chunks']
+
+    def __len__(self):
+        return self.rows
+
+    # Yields every chunk in order as a CountyTable with the data set's
+    # groups and typecodes. Only one chunk is held at a time.
+    # input: no input
+    # output: generator of CountyTable
+    def chunks(self):
+        with open(self.path, 'rb') as infile:
+            for offset, length, _ in self.offsets:
+                infile.seek(offset)
+                table = snapshot.decode(memoryview(infile.read(length)))
+                if table is None:
+                    raise ValueError('{} has a corrupt chunk at byte {}'.format(self.path, offset))
+                yield self._conform(table)
+
+    # Gives a chunk the columns of the whole data set: integral columns of a
+    # chunk become float where the data set's are, and a measure the chunk
+    # lacks is missing for every one of its counties.
+    def _conform(self, table: CountyTable) -> CountyTable:
+        columns = {}
+        for group, keys in self.groups.items():
+            for key in keys:
+                name = county_table.measure_name(group, key)
+                column = table.columns.get(name)
+                if column is None:
+                    column = array.array('d', [float('nan')]) * table.row_count
+                elif county_table.typecode(column) != self.typecodes[name]:
+                    column = array.array(self.typecodes[name], column)
+                columns[name] = column
+        table.columns = columns
+        table.groups = {group: list(keys) for group, keys in self.groups.items()}
+        return table
+
+
+# True when the built-in sum adds floats one at a time, left to right (as
+# CPython did before 3.12). From 3.12 on it keeps a Neumaier compensation
+# term alongside the running total and only adds it in at the end.
+_SEQUENTIAL_SUM = sum([1e16, 1.0, -1e16]) == 0.0
+
+# The range of a C long, which sum() adds ints within without making objects.
+_LONG_MAX = 2 ** (8 * struct.calcsize('l') - 1) - 1
+_LONG_MIN = -_LONG_MAX - 1
+
+
+# The built-in sum() of values that arrive a chunk at a time. The state
+# sum() keeps while it runs is carried from one chunk to the next and only
+# turned into a result at the end, so that every sum of a stage can share
+# one pass over the chunks. Before 3.12 that state is just the total. From
+# 3.12 on sum() goes through up to three phases, which are followed here:
+# an exact int total while every value is an int within a C long; then,
+# once the total is a float, a float total with a compensation term (an int
+# within a C long is added to the total directly); and, after any other
+# value, plain left-to-right addition with the compensation added in first.
+# Whether this matches the interpreter's sum() is checked when the module is
+# imported (see _CARRIED_SUM).
+class _RunningSum:
+    __slots__ = ('total', 'compensation', 'phase')
+
+    # Initialize a new _RunningSum, the sum of no values (the int 0).
+    def __init__(self):
+        self.total = 0
+        self.compensation = 0.0
+        self.phase = 'int'
+
+    # Adds values, in order, as sum() would go on to add them.
+    # input: iterable of numbers
+    # output: None
+    def add(self, values) -> None:
+        if _SEQUENTIAL_SUM:
+            self.total = sum(values, self.total)
+            return
+        values = iter(values)
+        total = self.total
+        if self.phase == 'int':
+            for value in values:
+                if (type(value) is int or type(value) is bool) and _LONG_MIN <= value <= _LONG_MAX \
+                        and _LONG_MIN <= total + value <= _LONG_MAX:
+                    total += value
+                    continue
+                total = total + value
+                self.phase = 'float' if type(total) is float else 'generic'
+                break
+        if self.phase == 'float':
+            compensation = self.compensation
+            for value in values:
+                if type(value) is float:
+                    added = total + value
+                    if abs(total) >= abs(value):
+                        compensation += (total - added) + value
+                    else:
+                        compensation += (value - added) + total
+                    total = added
+                elif isinstance(value, int) and _LONG_MIN <= value <= _LONG_MAX:
+                    total += value
+                else:
+                    if compensation and math.isfinite(compensation):
+                        total += compensation
+                    total = total + value
+                    self.phase = 'generic'
+                    break
+            self.compensation = compensation
+        if self.phase == 'generic':
+            total = functools.reduce(operator.add, values, total)
+        self.total = total
+
+    # Returns the sum of every value added so far.
+    def value(self):
+        compensation = self.compensation
+        if self.phase == 'float' and compensation and math.isfinite(compensation):
+            return self.total + compensation
+        return self.total
+
+
+# Returns whether _RunningSum gives exactly what the built-in sum() gives,
+# split into chunks at every point, on values where the ways of adding
+# floats differ: cancellation, signed zeros, infinities, NaN, ints before
+# and after floats and ints beyond a C long.
+def _check_running_sum() -> bool:
+    inf, nan = math.inf, math.nan
+    cases = [
+        [], [3, 5], [1e16, 1.0, -1e16], [0.1] * 10, [3, 5, 0.5, 1e100, 1.0, -1e100],
+        [-0.0], [-0.0, -0.0], [0.0, -0.0], [-0.0, 0], [inf, 1.0], [inf, -inf], [nan, 1.0], [1e308, 1e308, -1e308],
+        [2 ** 62, 2 ** 62, 0.5], [_LONG_MAX, 1, 0.5, 1e16, 1.0], [0.5, 2 ** 64, 1e16, 1.0, -1e16],
+        [0.5, 2 ** 64, 1.0, -2.0 ** 64], [2 ** 63, 1.0, 1e16, 1.0, -1e16],
+        [2 ** 31, 2 ** 31, 0.1, 1e16, 1.0], [1e16, 1.0, 2, -1e16], [0.1, 0.2, 2 ** 70, 0.3],
+    ]
+    for case in cases:
+        expected = repr(sum(case))
+        for cuts in range(2 ** max(len(case) - 1, 0)):
+            running = _RunningSum()
+            start = 0
+            for stop in range(1, len(case) + 1):
+                if stop == len(case) or cuts >> (stop - 1) & 1:
+                    running.add(case[start:stop])
+                    start = stop
+            if repr(running.value()) != expected:
+                return False
+    return True
+
+
+# True when a sum carried from chunk to chunk with _RunningSum is exactly
+# sum() over every value at once, so all the sums of a stage can share one
+# pass. Otherwise each sum is a single sum() over all the chunks' values,
+# at the cost of a pass per sum.
+_CARRIED_SUM = _check_running_sum()
+
+
+# An exact sum, kept per label, of values gathered from every chunk.
+class _Sum:
+    # Initialize a new _Sum.
+    # input: function of a chunk's selection yielding (label, values) pairs
+    #        (a label of None for an ungrouped sum)
+    # input: whether the labels vary, i.e. the sum is grouped
+    def __init__(self, parts, grouped: bool = False):
+        self.parts = parts
+        self.grouped = grouped
+        self.running = {}
+        self.totals = {}
+
+    # Adds one chunk's values to the carried sums.
+    def add(self, selection) -> None:
+        for label, values in self.parts(selection):
+            running = self.running.get(label)
+            if running is None:
+                running = self.running[label] = _RunningSum()
+            running.add(values)
+
+    # Sets totals to every label's carried sum, in the order the labels were found.
+    def finish(self) -> None:
+        self.totals = {label: running.value() for label, running in self.running.items()}
+
+    # Computes every sum with one sum() call over all the chunks.
+    # input: function returning a fresh iterator of the chunks' selections
+    def compute(self, selections) -> None:
+        labels = [None]
+        if self.grouped:
+            labels = dict.fromkeys(label for selection in selections() for label, _ in self.parts(selection))
+        for label in labels:
+            self.totals[label] = sum(chain.from_iterable(
+                values for selection in selections()
+                for part, values in self.parts(selection) if part == label))
+
+
+# The measure an aggregate line reads, as hw4.aggregate_value chooses it.
+def _measure(node) -> str | None:
+    if node.target == "Ethnicities":
+        return county_table.measure_name("Ethnicities", node.key)
+    if node.target == "Education":
+        return county_table.measure_name("Education", node.key)
+    if node.target == "Income":
+        return "Income.Persons Below Poverty Level"
+    return None
+
+
+def _populations(selection):
+    return aggregate.Aggregator.over(selection).populations()
+
+
+# The sums an aggregate line needs, and how its value follows from them.
+# input: PopulationTotal or Aggregate node, function splitting a chunk's
+#        selection into labelled groups (None for no grouping)
+# output: (list of _Sum, function of the _Sums and a label giving the value)
+def _aggregate_sums(node, split=None):
+    def parts(values):
+        if split is None:
+            return lambda selection: [(None, values(selection))]
+        return lambda selection: [(label, values(group)) for label, group in split(selection).items()]
+
+    total = _Sum(parts(_populations), split is not None)
+    if isinstance(node, ops_plan.PopulationTotal):
+        return [total], lambda label: total.totals[label]
+    measure = _measure(node)
+    if measure is None:
+        return [], lambda label: 0.0
+    population = _Sum(parts(lambda selection: aggregate.Aggregator.over(selection).weighted(measure)),
+                      split is not None)
+    if node.kind == "population:":
+        return [population], lambda label: population.totals[label]
+    return [population, total], lambda label: aggregate.percentage(population.totals[label], total.totals[label])
+
+
+# Runs .ops scripts over a ChunkedTable one chunk at a time. The script's
+# filters so far are kept as a chain and applied to each chunk as it is
+# read, so no selection larger than a chunk is ever held. Every line prints
+# exactly what hw4 prints for the same data held in memory.
+class StreamingRun:
+    # Initialize a new StreamingRun.
+    # input: the data set, output format of display
+    def __init__(self, source: ChunkedTable, display_format: str = render.TEXT):
+        self.source = source
+        self.display_format = display_format
+        self.filters = []
+
+    # Yields the selection each chunk is left with by the script's filters so far.
+    def selections(self):
+        for chunk in self.source.chunks():
+            selection = county_table.Selection(chunk, b'\x01' * chunk.row_count, whole=True)
+            for node in self.filters:
+                selection = hw4.filter_counties(selection, node)
+            yield selection
+
+    # Computes sums over the current selection, in one pass when sums can be
+    # carried across chunks and one pass per sum otherwise.
+    def compute(self, sums: list[_Sum]) -> None:
+        if not sums:
+            return
+        if not _CARRIED_SUM:
+            for total in sums:
+                total.compute(self.selections)
+            return
+        for selection in self.selections():
+            for total in sums:
+                total.add(selection)
+        for total in sums:
+            total.finish()
+
+    # Runs a run of filter lines in one pass, counting what each leaves.
+    def run_filters(self, steps) -> None:
+        counts = [0] * len(steps)
+        for selection in self.selections():
+            for index, step in enumerate(steps):
+                selection = hw4.filter_counties(selection, step.node)
+                counts[index] += len(selection)
+        for step, count in zip(steps, counts):
+            hw4.print_filter(step.node, count)
+            self.filters.append(step.node)
+
+    # Runs a run of aggregate lines, computing all their sums together.
+    def run_aggregates(self, steps) -> None:
+        plans = [_aggregate_sums(step.node) for step in steps]
+        self.compute([total for sums, _ in plans for total in sums])
+        for step, (_, value) in zip(steps, plans):
+            try:
+                hw4.print_aggregate(step.node, value(None))
+            except:
+                print("An Error occurred. (@ line {}: {})".format(step.number, step.text.strip()))
+
+    # Runs a groupby- line.
+    def run_group_by(self, node) -> None:
+        if node.by == "state":
+            split = hw4.group_by_state
+            labels = sorted
+        else:
+            thresholds = sorted(node.thresholds)
+            order = ["< {}".format(thresholds[0])] + \
+                    ["{} to < {}".format(low, high) for low, high in zip(thresholds, thresholds[1:])] + \
+                    [">= {}".format(thresholds[-1])]
+            split = lambda selection: hw4.group_by_bucket(selection, node.measure, node.key, node.thresholds)
+            labels = lambda found: [label for label in order if label in found]
+        sums, value = _aggregate_sums(node.aggregate, split)
+        if sums:
+            self.compute(sums)
+            found = sums[0].totals
+        else:
+            found = {label: None for selection in self.selections() for label in split(selection)}
+        for label in labels(found):
+            hw4.print_aggregate(node.aggregate, value(label), "[{}]".format(label))
+
+    # Runs a display line, writing each chunk's counties as it is read.
+    def run_display(self) -> None:
+        stream = chain.from_iterable(map(render.rows, self.selections()))
+        for text in render.format_rows(stream, self.display_format, groups=self.source.groups):
+            sys.stdout.write(text)
+
+    # Runs one line that is not part of a filter or aggregate run.
+    def run_single(self, node) -> None:
+        if isinstance(node, ops_plan.Invalid):
+            raise ValueError("Error: Invalid input.")
+        if isinstance(node, ops_plan.GroupBy):
+            self.run_group_by(node)
+        elif isinstance(node, ops_plan.Display):
+            self.run_display()
+
+    # Runs a compiled script, reporting any line that fails as hw4.run_plan does.
+    # input: ops_plan.Plan
+    # output: None
+    def run_plan(self, plan: ops_plan.Plan) -> None:
+        for stage in plan.stages:
+            if stage.kind == ops_plan.FILTER_STAGE:
+                self.run_filters(stage.steps)
+            elif stage.kind == ops_plan.AGGREGATE_STAGE:
+                self.run_aggregates(stage.steps)
+            else:
+                for step in stage.steps:
+                    try:
+                        self.run_single(step.node)
+                    except:
+                        print("An Error occurred. (@ line {}: {})".format(step.number, step.text.strip()))
+
+
+# Runs one .ops file against a chunked data file, printing its results.
+# input: str path of the .ops file, path of the chunked file, output format of display
+# output: None
+def run_file(file: str, data_path: str, display_format: str = render.TEXT) -> None:
+    print(file)
+
+    with open(file, 'r') as infile:
+
+        source = ChunkedTable(data_path)
+        print(len(source), "records loaded.")
+
+        StreamingRun(source, display_format).run_plan(ops_plan.compile_source(infile.read()))
+
+
+# Writes a data file as a chunked file.
+# Usage: python stream.py convert OUTPUT [--source DATA] [--chunk-rows N]
+def convert(arguments: list[str]) -> None:
+    import argparse
+    import county_demographics
+    parser = argparse.ArgumentParser(prog="stream.py convert", description="Write a data set as a chunked file.")
+    parser.add_argument("output", help="path of the chunked file to write")
+    parser.add_argument("--source", default=county_demographics.get_database_path(),
+                        help="CORGIS pickle or JSON Lines file to read (default: the county data set)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                        help="counties per chunk (default: {})".format(CHUNK_ROWS))
+    args = parser.parse_args(arguments)
+    print(write(records_from(args.source), args.output, args.chunk_rows), "records written.")
+
+# Usage: python stream.py DATA FILE.ops [text|csv|jsonl]
+#        runs inputs/FILE.ops against the chunked file DATA, printing what hw4.py prints
+def main():
+    run_file("inputs/"+sys.argv[2], sys.argv[1], *sys.argv[3:4])
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ["convert"]:
+        convert(sys.argv[2:])
+        sys.exit()
+    try:
+        main()
+    except:
+        print("ERROR: File not found.")
@@ -0,0 +1,207 @@
+import contextlib
+import copy
+import io
+import random
+
+import pytest
+
+import aggregate
+import build_data
+import hw4
+import ops_plan
+import result_cache
+from county_table import Selection
+
+STATES = ["CA", "TX", "WY", "OR"]
+
+# Scripts covering the state index, the sorted indexes, the cached
+# selections and the cached totals and sub-populations.
+SCRIPTS = [
+    "population-total\npercent:Education.Bachelor's Degree or Higher\npopulation:Income.Persons Below Poverty Level",
+    "filter-state:CA\npopulation-total\npercent:Ethnicities.Asian Alone",
+    "filter-state:TX\nfilter-gt:Education.Bachelor's Degree or Higher:30\npopulation-total\n"
+    "population:Education.High School or Higher",
+    "filter-lt:Income.Persons Below Poverty Level:20\npopulation-total\npercent:Ethnicities.White Alone",
+    "filter-gt:Ethnicities.Asian Alone:10\nfilter-state:CA\npopulation-total",
+    "groupby-state percent:Income.Persons Below Poverty Level",
+    "groupby-bucket:Education.Bachelor's Degree or Higher:20,40 population-total",
+    "filter-state:OR\ndisplay",
+]
+
+
+def _record(rng, state, county):
+    return {
+        'State': state,
+        'County': county,
+        'Age': {'Percent 65 and Older': round(rng.uniform(5, 30), 1),
+                'Percent Under 18 Years': round(rng.uniform(10, 30), 1)},
+        'Education': {"Bachelor's Degree or Higher": round(rng.uniform(5, 60), 1),
+                      'High School or Higher': round(rng.uniform(60, 95), 1)},
+        'Ethnicities': {'Asian Alone': round(rng.uniform(0, 30), 1),
+                        'White Alone': round(rng.uniform(30, 95), 1)},
+        'Income': {'Median Household Income': rng.randint(30000, 90000),
+                   'Persons Below Poverty Level': round(rng.uniform(5, 35), 1)},
+        'Population': {'2010 Population': rng.randint(1000, 10**6),
+                       '2014 Population': rng.randint(1000, 10**6)},
+    }
+
+
+def _records(seed=0, count=40):
+    rng = random.Random(seed)
+    return [_record(rng, STATES[index % len(STATES)], "County {}".format(index)) for index in range(count)]
+
+
+def _run(table, script):
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        hw4.run_plan(table, ops_plan.compile_source(script))
+    return buffer.getvalue()
+
+
+# Returns a table of the records with every index built and every script's
+# results cached, so that a delta has to patch them.
+def _warm_table(records):
+    table = build_data.convert_report(copy.deepcopy(records))
+    for script in SCRIPTS:
+        _run(table, script)
+    return table
+
+
+# Applies a delta to a plain list of records, as a reload would see it.
+def _edited(records, upserts, deletes):
+    current = {(record['State'], record['County']): record for record in records}
+    for key in deletes:
+        current.pop(tuple(key), None)
+    for record in upserts:
+        current[(record['State'], record['County'])] = record
+    return list(current.values())
+
+
+# Checks that every script gives the same output on the updated table as on
+# a table converted from the edited records.
+def _assert_matches(table, records):
+    fresh = build_data.convert_report(copy.deepcopy(records))
+    assert len(table) == len(fresh)
+    for script in SCRIPTS:
+        assert _run(table, script) == _run(fresh, script), script
+
+
+@pytest.fixture(autouse=True)
+def _clear_results():
+    result_cache.results.clear()
+    yield
+    result_cache.results.clear()
+
+
+def test_update_insert_and_delete():
+    records = _records()
+    table = _warm_table(records)
+    rng = random.Random(1)
+    updated = copy.deepcopy(records[3])
+    updated['Population']['2014 Population'] += 12345
+    updated['Education']["Bachelor's Degree or Higher"] = 55.5
+    moved = copy.deepcopy(records[5])
+    moved['Ethnicities']['Asian Alone'] = 29.9
+    upserts = [updated, moved, _record(rng, "CA", "New County"), _record(rng, "NV", "Only County")]
+    deletes = [("TX", records[1]['County']), ("CA", "No Such County")]
+
+    assert table.apply_delta(copy.deepcopy(upserts), deletes) == (2, 2, 1)
+
+    assert table.version == 1
+    _assert_matches(table, _edited(records, upserts, deletes))
+
+
+def test_delete_every_county_of_a_state():
+    records = _records()
+    table = _warm_table(records)
+    deletes = [(record['State'], record['County']) for record in records if record['State'] == "OR"]
+
+    assert table.apply_delta(deletes=deletes) == (0, 0, len(deletes))
+
+    assert len(hw4.filter_by_state(table, "OR")) == 0
+    _assert_matches(table, _edited(records, [], deletes))
+
+
+def test_float_population_and_changed_keys():
+    records = _records()
+    table = _warm_table(records)
+    fractional = copy.deepcopy(records[0])
+    fractional['Population']['2014 Population'] = 1234.5
+    missing = copy.deepcopy(records[2])
+    del missing['Education']['High School or Higher']
+    added = copy.deepcopy(records[4])
+    added['Ethnicities']['Two or More Races'] = 3.5
+    upserts = [fractional, missing, added]
+
+    table.apply_delta(copy.deepcopy(upserts))
+
+    _assert_matches(table, _edited(records, upserts, []))
+
+
+def test_selection_made_before_the_update_is_unchanged():
+    records = _records()
+    table = _warm_table(records)
+    before = hw4.filter_by_state(table, "CA")
+    total = hw4.population_list(before)
+
+    table.apply_delta(deletes=[("CA", before[0].county)])
+
+    assert hw4.population_list(before) == total
+    assert len(hw4.filter_by_state(table, "CA")) == len(before) - 1
+
+
+def test_aggregator_made_before_the_update_reads_the_new_values():
+    records = _records()
+    table = _warm_table(records)
+    before = hw4.filter_by_state(table, "CA")
+    aggregator = aggregate.Aggregator.over(before)
+    measure = "Education.Bachelor's Degree or Higher"
+    aggregator.percent(measure)
+    updated = copy.deepcopy(records[0])
+    updated['Population']['2014 Population'] += 5000
+    updated['Education']["Bachelor's Degree or Higher"] = 12.5
+
+    table.apply_delta([updated, _record(random.Random(2), "CA", "New County")])
+
+    fresh = aggregate.Aggregator.over(list(before))
+    assert aggregator.total() == fresh.total() == hw4.population_list(list(before))
+    assert aggregator.population(measure) == fresh.population(measure)
+    assert aggregator.percent(measure) == fresh.percent(measure)
+
+
+@pytest.mark.parametrize("damage, error", [
+    (lambda record: record.pop('Population'), KeyError),
+    (lambda record: record.pop('County'), KeyError),
+    (lambda record: record['Education'].update({'High School or Higher': "ninety"}), TypeError),
+    (lambda record: record.update({'Income': [("Persons Below Poverty Level", 5.0)]}), TypeError),
+], ids=["missing group", "missing county", "text value", "group not a mapping"])
+def test_bad_record_leaves_the_table_unchanged(damage, error):
+    records = _records()
+    table = _warm_table(records)
+    california = hw4.filter_by_state(table, "CA")
+    good = copy.deepcopy(records[1])
+    good['Population']['2014 Population'] = 1
+    bad = copy.deepcopy(records[0])
+    damage(bad)
+
+    with pytest.raises(error):
+        table.apply_delta([good, bad], deletes=[("CA", records[0]['County'])])
+
+    assert table.version == 0
+    assert hw4.filter_by_state(table, "CA") == california
+    assert len(table.state_rows("CA")) == len(california)
+    _assert_matches(table, records)
+
+
+def test_cached_selections_follow_the_update():
+    records = _records()
+    table = _warm_table(records)
+    moved = copy.deepcopy(records[1])
+    moved['Income']['Persons Below Poverty Level'] = 1.0
+
+    table.apply_delta([moved])
+
+    cached = hw4.below_poverty_level_less_than(table, 20)
+    rebuilt = Selection.all(table).where(table.threshold_mask("Income.Persons Below Poverty Level", "lt", 20))
+    assert cached == rebuilt
+    assert any(county.county == moved['County'] for county in cached)